@@ -0,0 +1,178 @@
+"""Розсилка оголошень усім, хто писав боту.
+
+Всі розсилки ділять одне відро токенів на BROADCAST_RATE повідомлень за секунду,
+тож 50k повідомлень ідуть приблизно 50000 / BROADCAST_RATE секунд без 429.
+Прогрес (курсор і лічильники) зберігається щосекунди, після перезапуску
+розсилка продовжується з першого незавершеного отримувача.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime
+
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError,
+    TelegramRetryAfter, TelegramServerError
+)
+
+from config import BROADCAST_RATE, BROADCAST_ACTIVE_DAYS
+from db import get_broadcast_job, get_broadcast_jobs, get_broadcast_recipients, update_broadcast_job
+from ratelimit import TokenBucket
+
+logger = logging.getLogger("bot.broadcast")
+
+# Скільки отримувачів читається з БД за раз
+PAGE_SIZE = 500
+# Скільки надсилань може бути в польоті одночасно
+MAX_IN_FLIGHT = 50
+# Як часто зберігати прогрес, с
+CHECKPOINT_INTERVAL = 1.0
+MAX_ATTEMPTS = 3
+
+# Спільне для всіх розсилок: без запасу на сплески, щоб рівномірно тримати ліміт
+bucket = TokenBucket(BROADCAST_RATE, capacity=1)
+
+_tasks = {}
+# Встановлюється перед завершенням процесу (див. stop_jobs)
+_stopping = False
+
+
+async def _send(bot, chat_id: int, text: str) -> str:
+    """Надсилає одне повідомлення: "delivered", "blocked" або "failed"."""
+    attempts = 0
+    while attempts < MAX_ATTEMPTS:
+        await bucket.acquire()
+        try:
+            await bot.send_message(chat_id, text)
+            return "delivered"
+        except TelegramRetryAfter as e:
+            # Пауза для всіх розсилок одразу: ліміт у Telegram спільний для бота
+            logger.warning("Розсилка отримала 429, пауза %s с", e.retry_after)
+            bucket.pause(e.retry_after)
+        except TelegramForbiddenError:
+            return "blocked"
+        except TelegramBadRequest:
+            return "failed"
+        except (TelegramNetworkError, TelegramServerError) as e:
+            attempts += 1
+            logger.warning("Помилка мережі під час розсилки (спроба %s): %s", attempts, e)
+            await asyncio.sleep(attempts)
+    return "failed"
+
+
+async def run_job(bot, job_id: int):
+    job = await get_broadcast_job(job_id)
+    if job is None or job.status != "running":
+        return
+
+    cursor = fetch_cursor = job.cursor
+    counts = {"delivered": job.delivered, "failed": job.failed, "blocked": job.blocked}
+    logger.info("Розсилка #%s: старт з курсора %s", job_id, cursor)
+
+    # Надсилання йдуть паралельно (інакше швидкість обмежує затримка Bot API), але курсор
+    # зсувається лише по неперервному префіксу завершених, тож після перезапуску
+    # повторно можуть піти не більше MAX_IN_FLIGHT повідомлень
+    in_flight = deque()
+    last_checkpoint = time.monotonic()
+
+    def settle_completed():
+        nonlocal cursor
+        while in_flight and in_flight[0][1].done():
+            recipient, task = in_flight.popleft()
+            result = task.result()
+            if result == "delivered":
+                counts["delivered"] += 1
+            else:
+                counts["failed"] += 1
+                if result == "blocked":
+                    counts["blocked"] += 1
+            cursor = recipient
+
+    async def checkpoint():
+        nonlocal last_checkpoint
+        last_checkpoint = time.monotonic()
+        await update_broadcast_job(job_id, cursor=cursor, **counts)
+
+    try:
+        while not _stopping:
+            page = await get_broadcast_recipients(job, fetch_cursor, PAGE_SIZE, BROADCAST_ACTIVE_DAYS)
+            if page is None:
+                await asyncio.sleep(5)
+                continue
+            if not page:
+                break
+
+            for recipient in page:
+                if _stopping:
+                    break
+                in_flight.append((recipient, asyncio.create_task(_send(bot, int(recipient), job.text))))
+                if len(in_flight) >= MAX_IN_FLIGHT:
+                    await asyncio.wait([in_flight[0][1]])
+                settle_completed()
+                if time.monotonic() - last_checkpoint >= CHECKPOINT_INTERVAL:
+                    await checkpoint()
+            fetch_cursor = page[-1]
+
+        await asyncio.gather(*(task for _, task in in_flight))
+        settle_completed()
+        await checkpoint()
+    finally:
+        for _, task in in_flight:
+            task.cancel()
+
+    if _stopping:
+        logger.info("Розсилка #%s призупинена до перезапуску", job_id, extra=counts)
+        return
+    await update_broadcast_job(job_id, only_status="running", status="done", finished_at=datetime.utcnow())
+    logger.info("Розсилка #%s завершена", job_id, extra=counts)
+
+    try:
+        await bot.send_message(
+            int(job.created_by),
+            f"📢 Розсилку #{job_id} завершено.\n"
+            f"✅ Доставлено: {counts['delivered']}\n"
+            f"❌ Не доставлено: {counts['failed']} (з них заблокували бота: {counts['blocked']})"
+        )
+    except Exception as e:
+        logger.warning("Не вдалося надіслати звіт про розсилку: %s", e)
+
+
+def start_job(bot, job_id: int):
+    task = asyncio.create_task(run_job(bot, job_id))
+    _tasks[job_id] = task
+    task.add_done_callback(lambda _: _tasks.pop(job_id, None))
+    return task
+
+
+async def resume_jobs(bot):
+    """Відновлює розсилки, перервані перезапуском."""
+    for job in await get_broadcast_jobs(status="running"):
+        if job.id not in _tasks:
+            start_job(bot, job.id)
+
+
+async def stop_jobs(timeout: float):
+    """Зупиняє розсилки перед завершенням процесу.
+
+    Нові надсилання не починаються, ті, що вже в польоті, дочікуються, а курсор
+    зберігається; статус лишається "running", тож resume_jobs продовжить розсилку
+    без повторів. Що не завершилося за timeout секунд, скасовується.
+    """
+    global _stopping
+    _stopping = True
+    if not _tasks:
+        return
+    _, pending = await asyncio.wait(list(_tasks.values()), timeout=timeout)
+    for task in pending:
+        task.cancel()
+
+
+async def cancel_job(job_id: int) -> bool:
+    if not await update_broadcast_job(job_id, only_status="running", status="cancelled",
+                                      finished_at=datetime.utcnow()):
+        return False
+    task = _tasks.pop(job_id, None)
+    if task:
+        task.cancel()
+    return True
@@ -3,17 +3,72 @@ import os
 from dotenv import load_dotenv
 from aiogram.fsm.state import State, StatesGroup
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from fsm_storage import DbStorage
 
 load_dotenv()
 TOKEN = os.getenv("BOT_TOKEN")
 
 CURATOR_CHAT_ID = int(os.getenv("CURATOR_CHAT_ID")) if os.getenv("CURATOR_CHAT_ID") else None
-TEACHERS_IDS = [int(id.strip()) for id in os.getenv("TEACHERS_IDS", "").split(",")]
+TEACHERS_IDS = [int(id.strip()) for id in os.getenv("TEACHERS_IDS", "").split(",") if id.strip()]
 ADMIN_ID = int(os.getenv("ADMIN_ID")) if os.getenv("ADMIN_ID") else None
+# Кілька форумів кураторів (див. shards.py): "math=-1001,physics=-1002,-1003".
+# Якщо не задано, всі запити йдуть у CURATOR_CHAT_ID
+CURATOR_CHAT_IDS = os.getenv("CURATOR_CHAT_IDS", "")
+# Повідомлень бота за хвилину в один форум (Telegram допускає ~20 у групу; 0 - без обмеження)
+FORUM_RATE_PER_MINUTE = float(os.getenv("FORUM_RATE_PER_MINUTE", "20"))
+FORUM_BURST = int(os.getenv("FORUM_BURST", "20"))
+# Альтернативний Bot API сервер (локальний сервер або симулятор з fake_api.py)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+# Файл для запису вхідних оновлень (див. recorder.py; кожен запуск пише окремий файл
+# з часом старту в імені), за замовчуванням вимкнено
+RECORD_UPDATES = os.getenv("RECORD_UPDATES")
+# Розсилки: повідомлень на секунду (Telegram допускає ~30, решту лишаємо живим обробникам)
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+# Аудиторія "active" - студенти, що писали за останні N днів
+BROADCAST_ACTIVE_DAYS = int(os.getenv("BROADCAST_ACTIVE_DAYS", "30"))
+# Захист від флуду (throttling.py): оновлень на секунду і запас на одного користувача,
+# скільки оновлень обробляється одночасно, скільки секунд чекати місця і як часто попереджати
+FLOOD_RATE = float(os.getenv("FLOOD_RATE", "0.5"))
+FLOOD_BURST = int(os.getenv("FLOOD_BURST", "5"))
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "100"))
+FLOOD_DEFER_TIMEOUT = float(os.getenv("FLOOD_DEFER_TIMEOUT", "5"))
+FLOOD_NOTICE_WINDOW = float(os.getenv("FLOOD_NOTICE_WINDOW", "30"))
+# Звіти (digest.py): час щоденного і щотижневого звіту за Києвом (порожній рядок вимикає),
+# норма часу реакції на запит і скільки годин запит може висіти на утриманні
+DIGEST_DAILY_AT = os.getenv("DIGEST_DAILY_AT", "09:00")
+DIGEST_WEEKLY_AT = os.getenv("DIGEST_WEEKLY_AT", "mon 09:00")
+SLA_MINUTES = int(os.getenv("SLA_MINUTES", "30"))
+STALE_HOLD_HOURS = int(os.getenv("STALE_HOLD_HOURS", "48"))
+# Профілювання (profiling.py): увімкнене одразу після старту, поріг повільного обробника
+# і що знімати для повільних обробників - "stack" (стек корутини) або "cprofile"
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "").lower() in ("1", "true", "yes")
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "500"))
+PROFILE_MODE = os.getenv("PROFILE_MODE", "stack")
+
+# Плавна зупинка (lifecycle.py): скільки секунд чекати обробники, розсилки і задачі.
+# Має бути меншим за час, який дає оркестратор до SIGKILL (docker stop - 10 с)
+# Обробники, що не встигли, процес-заміна виконає ще раз з початку (див. lifecycle.py)
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "8"))
+
+_bot = None
+
+
+def get_bot() -> Bot:
+    """Створює бота при першому зверненні: імпорт модулів не потребує токена."""
+    global _bot
+    if _bot is None:
+        if TELEGRAM_API_URL:
+            _bot = Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+        else:
+            _bot = Bot(token=TOKEN)
+    return _bot
+
 
-bot = Bot(token=TOKEN)
-storage = MemoryStorage()
+# Стани FSM зберігаються в БД, щоб пережити заміну процесу (див. fsm_storage.py)
+storage = DbStorage()
 dp = Dispatcher(storage=storage)
 
 class ReplyState(StatesGroup):
@@ -1,111 +1,390 @@
 import os
 import asyncio
+import logging
+from datetime import datetime, timedelta
 
 from dotenv import load_dotenv
+from sqlalchemy import MetaData, String, Table, cast, delete, func, insert, inspect, literal, text, tuple_, update
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy.future import select
 
-from models import CuratorLog, CuratorMessage, Teacher, Base
+from models import (
+    CuratorLog, CuratorMessage, Teacher, BroadcastJob, StudentRequest, Snippet, ScheduledTask, SchemaVersion,
+    BotState, PendingUpdate, FsmRecord, Base, SCHEMA_VERSION
+)
+from keyboards import STATUS_DONE
+from engine_profiles import WriteQueue, engine_kwargs, install_sqlite_pragmas, resolve_profile
+from profiling import span
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_async_engine(DATABASE_URL, echo=True)
-SessionLocal = sessionmaker(
-    autocommit=False, autoflush=False, bind=engine, class_=AsyncSession
-)
+logger = logging.getLogger("bot.db")
+
+# Дії кураторів, як вони записуються в curator_logs
+ACTION_TAKE = "взяв у роботу"
+ACTION_FINISH = "завершив діалог"
+ACTION_HOLD = "поставив на утримання"
+ACTION_REASSIGN = "переназначив запит"
+
+engine = None
+SessionLocal = None
+# Черга єдиного писача (лише для профілю sqlite), інакше None
+write_queue = None
+ENGINE_PROFILE = None
+
+
+def configure_engine(url: str, profile: str = None):
+    """Створює рушій і фабрику сесій для профілю, обраного за url (див. engine_profiles.py)."""
+    global engine, SessionLocal, write_queue, ENGINE_PROFILE
+
+    ENGINE_PROFILE = resolve_profile(url, profile)
+    # SQL-запити логуються через логер sqlalchemy.engine (див. LOG_SQL у log_config.py)
+    engine = create_async_engine(url, **engine_kwargs(ENGINE_PROFILE))
+    SessionLocal = sessionmaker(
+        autocommit=False, autoflush=False, bind=engine, class_=AsyncSession
+    )
+    write_queue = None
+    if ENGINE_PROFILE == "sqlite":
+        install_sqlite_pragmas(engine, url)
+        write_queue = WriteQueue(SessionLocal)
+    return engine
+
+
+def get_engine():
+    """Рушій за DATABASE_URL; створюється при першому зверненні, а не при імпорті."""
+    if engine is None:
+        if not DATABASE_URL:
+            raise RuntimeError("DATABASE_URL не знайдено в .env файлі")
+        configure_engine(DATABASE_URL)
+    return engine
+
+
+def new_session() -> AsyncSession:
+    get_engine()
+    return SessionLocal()
+
+
+def _upgrade_schema(connection):
+    """Створює відсутні таблиці, колонки й індекси. Нічого не видаляє і не змінює."""
+    Base.metadata.create_all(connection)
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(connection.dialect)}"
+            if column.default is not None and column.default.is_scalar:
+                default = literal(column.default.arg).compile(
+                    dialect=connection.dialect, compile_kwargs={"literal_binds": True}
+                )
+                ddl += f" DEFAULT {default}"
+            connection.execute(text(ddl))
+            logger.info("Додано колонку", extra={"table": table.name, "column": column.name})
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(connection)
+
+
+def _move_legacy_requests(connection):
+    """Переносить запити зі старої таблиці student_requests (ключ - message_id) у requests.
+
+    Виконується, доки requests порожня. Лічильник id ставиться вище за всі числові
+    request_id у журналах, щоб нові запити не збігалися зі старими в історії та звітах.
+    """
+    if connection.execute(select(func.count()).select_from(StudentRequest)).scalar_one():
+        return
+    inspector = inspect(connection)
+    legacy_ids = set()
+    if inspector.has_table("student_requests"):
+        legacy = Table("student_requests", MetaData(), autoload_with=connection)
+        moved = []
+        for row in connection.execute(select(legacy)).mappings():
+            if str(row["request_id"]).isdigit():
+                fields = {key: value for key, value in row.items() if key != "request_id"}
+                moved.append({**fields, "id": int(row["request_id"])})
+        if moved:
+            connection.execute(insert(StudentRequest), moved)
+            logger.info("Запити перенесено в нову таблицю", extra={"count": len(moved)})
+        legacy_ids.update(row["id"] for row in moved)
+    for model in (CuratorMessage, CuratorLog):
+        for request_id in connection.execute(select(model.request_id).distinct()).scalars():
+            if request_id.isdigit():
+                legacy_ids.add(int(request_id))
+    if not legacy_ids:
+        return
+    last_id = max(legacy_ids)
+    table = StudentRequest.__tablename__
+    if connection.dialect.name == "sqlite":
+        updated = connection.execute(text("UPDATE sqlite_sequence SET seq = :seq WHERE name = :name"),
+                                     {"seq": last_id, "name": table})
+        if not updated.rowcount:
+            connection.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)"),
+                               {"seq": last_id, "name": table})
+    elif connection.dialect.name == "postgresql":
+        connection.execute(text("SELECT setval(pg_get_serial_sequence(:name, 'id'), :seq)"),
+                           {"seq": last_id, "name": table})
+    else:
+        logger.warning("Лічильник id запитів не зсунуто: невідома СУБД", extra={"dialect": connection.dialect.name})
+        return
+    logger.info("Лічильник id запитів зсунуто за старі ключі", extra={"request_id": last_id})
+
+
+def _backfill_message_students(connection):
+    """Заповнює student_id у старих рядках curator_messages.
+
+    Повідомлення студента належить йому самому; відповідь куратора - студенту запиту,
+    якщо під цим request_id писав лише один студент (інакше рядок лишається без власника).
+    """
+    connection.execute(text(
+        "UPDATE curator_messages SET student_id = sender_id "
+        "WHERE student_id IS NULL AND sender_type = 'student'"
+    ))
+    connection.execute(text(
+        "UPDATE curator_messages SET student_id = ("
+        "SELECT MIN(m.sender_id) FROM curator_messages m "
+        "WHERE m.request_id = curator_messages.request_id AND m.sender_type = 'student' "
+        "GROUP BY m.request_id HAVING COUNT(DISTINCT m.sender_id) = 1"
+        ") WHERE student_id IS NULL AND sender_type = 'curator'"
+    ))
+
+
+async def get_schema_version():
+    """Версія схеми в БД або None, якщо таблиці версій ще немає."""
+    try:
+        async with new_session() as session:
+            result = await session.execute(select(SchemaVersion.version).where(SchemaVersion.id == 1))
+            return result.scalar_one_or_none()
+    except SQLAlchemyError:
+        return None
 
 
-async def create_tables():
+async def create_tables(from_version: int = None):
     try:
-        async with engine.begin() as conn:
-            await conn.run_sync(Base.metadata.create_all)
-        print("Таблиці успішно створено.")
-    except SQLAlchemyError as e:
-        print(f"Помилка при створенні таблиць: {e}")
+        async with get_engine().begin() as conn:
+            await conn.run_sync(_upgrade_schema)
+            await conn.run_sync(_move_legacy_requests)
+            await conn.run_sync(_backfill_message_students)
+            await conn.execute(delete(SchemaVersion))
+            await conn.execute(insert(SchemaVersion).values(
+                id=1, version=SCHEMA_VERSION, applied_at=datetime.utcnow()
+            ))
+        logger.info("Схему БД оновлено", extra={"from_version": from_version, "schema_version": SCHEMA_VERSION})
+        return True
+    except SQLAlchemyError:
+        logger.exception("Помилка при створенні таблиць")
+        return False
 
 
 async def init_db():
-    await create_tables()
+    """Виконує DDL лише тоді, коли версія схеми в БД відстає від SCHEMA_VERSION."""
+    version = await get_schema_version()
+    if version is not None and version >= SCHEMA_VERSION:
+        if version > SCHEMA_VERSION:
+            logger.warning("Схема БД новіша за код", extra={"schema_version": version})
+        logger.info("Схема БД актуальна, DDL пропущено", extra={"schema_version": version})
+        return True
+    return await create_tables(from_version=version)
+
+
+async def close_db():
+    """Дописує чергу записів і закриває з'єднання."""
+    if engine is None:
+        return
+    if write_queue is not None:
+        await write_queue.close()
+    await engine.dispose()
 
 
 async def get_db_session():
     """Повертає асинхронну сесію для роботи з базою даних."""
-    async with SessionLocal() as session:
+    async with new_session() as session:
         yield session
 
 
+async def _insert(entry, merge: bool = False) -> bool:
+    """Додає запис (з merge=True - вставляє або оновлює за первинним ключем):
+    через чергу єдиного писача, якщо вона є, інакше окремою транзакцією."""
+    get_engine()
+    if write_queue is not None:
+        # Запис виконує воркер черги, тож для профілювання міряється очікування результату
+        with span("db", "write_queue"):
+            written = await write_queue.submit(entry, merge=merge)
+        if not written:
+            raise SQLAlchemyError("пакетний запис не вдався")
+        return True
+    async with SessionLocal() as session:
+        if merge:
+            await session.merge(entry)
+        else:
+            session.add(entry)
+        await session.commit()
+    return True
+
+
 async def log_curator_action(request_id: str, curator_id: int, action: str):
     """Логує дію куратора у таблицю curator_logs."""
     try:
-        async with SessionLocal() as session:
-            log_entry = CuratorLog(
-                request_id=request_id,
-                curator_id=str(curator_id),
-                action=action
-            )
-            session.add(log_entry)
+        await _insert(CuratorLog(
+            request_id=request_id,
+            curator_id=str(curator_id),
+            action=action
+        ))
+        logger.debug("Дію куратора залоговано", extra={"request_id": request_id, "action": action, "hot": True})
+        return True
+    except SQLAlchemyError:
+        logger.exception("Помилка при логуванні дії куратора", extra={"request_id": request_id})
+        return False
+
+
+async def log_message(request_id: str, sender_id: int, sender_type: str, message_text: str, student_id: int = None):
+    """Логує повідомлення у таблицю curator_messages (student_id за замовчуванням - відправник-студент)."""
+    if student_id is None and sender_type == "student":
+        student_id = sender_id
+    try:
+        await _insert(CuratorMessage(
+            request_id=request_id,
+            student_id=str(student_id) if student_id is not None else None,
+            sender_id=str(sender_id),
+            sender_type=sender_type,
+            message_text=message_text
+        ))
+        logger.debug("Повідомлення залоговано",
+                     extra={"request_id": request_id, "sender_type": sender_type, "hot": True})
+        return True
+    except SQLAlchemyError:
+        logger.exception("Помилка при логуванні повідомлення", extra={"request_id": request_id})
+        return False
+
+
+def _request_fields(fields: dict) -> dict:
+    for key in ("student_id", "curator_id"):
+        if fields.get(key) is not None:
+            fields[key] = str(fields[key])
+    fields.setdefault("updated_at", datetime.utcnow())
+    return fields
+
+
+async def create_request(**fields):
+    """Створює запит і повертає його id (рядком, як ключ у кеші main.py); None при помилці.
+
+    Пише окремою транзакцією, повз чергу єдиного писача: id потрібен до створення теми.
+    """
+    try:
+        async with new_session() as session:
+            request = StudentRequest(**_request_fields(fields))
+            session.add(request)
+            await session.flush()
+            request_id = request.id
             await session.commit()
-            print("Дію куратора успішно залоговано.")
-            return True
-    except SQLAlchemyError as e:
-        print(f"Помилка при логуванні дії куратора: {e}")
+        return str(request_id)
+    except SQLAlchemyError:
+        logger.exception("Помилка при створенні запиту", extra={"student_id": fields.get("student_id")})
+        return None
+
+
+async def save_request(request_id: str, **fields):
+    """Зберігає стан запиту: передані поля вставляються або оновлюються за request_id."""
+    try:
+        await _insert(StudentRequest(id=int(request_id), **_request_fields(fields)), merge=True)
+        return True
+    except SQLAlchemyError:
+        logger.exception("Помилка при збереженні запиту", extra={"request_id": request_id})
         return False
 
 
-async def log_message(request_id: str, sender_id: int, sender_type: str, message_text: str):
-    """Логує повідомлення у таблицю curator_messages."""
+async def get_open_requests():
+    """Усі незавершені запити, від найстаршого"""
+    try:
+        async with new_session() as session:
+            query = (select(StudentRequest)
+                     .where(StudentRequest.status != STATUS_DONE)
+                     .order_by(StudentRequest.created_at))
+            result = await session.execute(query)
+            return result.scalars().all()
+    except SQLAlchemyError:
+        logger.exception("Помилка при отриманні відкритих запитів")
+        return []
+
+
+async def close_topicless_requests():
+    """Закриває запити, для яких так і не створено тему (процес зупинився посередині).
+
+    Викликається лише власником опитування до обробки оновлень: інакше під закриття
+    потрапили б запити, тему для яких саме створює інший процес.
+    """
     try:
-        async with SessionLocal() as session:
-            message_entry = CuratorMessage(
-                request_id=request_id,
-                sender_id=str(sender_id),
-                sender_type=sender_type,
-                message_text=message_text
+        async with new_session() as session:
+            result = await session.execute(
+                update(StudentRequest)
+                .where(StudentRequest.thread_id.is_(None), StudentRequest.status != STATUS_DONE)
+                .values(status=STATUS_DONE, updated_at=datetime.utcnow())
             )
-            session.add(message_entry)
             await session.commit()
-            print("Повідомлення успішно залоговано.")
-            return True
-    except SQLAlchemyError as e:
-        print(f"Помилка при логуванні повідомлення: {e}")
-        return False
+            return result.rowcount
+    except SQLAlchemyError:
+        logger.exception("Помилка при закритті запитів без теми")
+        return 0
+
+
+async def get_student_history(student_id: int, exclude_request_id: str = None, before=None, limit: int = 10):
+    """Повідомлення попередніх запитів студента, від найновішого (None при помилці).
+
+    before - курсор (message_time, id) останнього показаного повідомлення: наступна
+    сторінка читається за індексом одразу від курсора, без OFFSET.
+    """
+    # Лише рядки самого студента: request_id старих запитів міг збігатися в різних студентів
+    query = select(CuratorMessage).where(CuratorMessage.student_id == str(student_id))
+    if exclude_request_id:
+        query = query.where(CuratorMessage.request_id != exclude_request_id)
+    if before is not None:
+        query = query.where(tuple_(CuratorMessage.message_time, CuratorMessage.id) < tuple_(*before))
+    query = query.order_by(CuratorMessage.message_time.desc(), CuratorMessage.id.desc()).limit(limit)
+    try:
+        async with new_session() as session:
+            result = await session.execute(query)
+            return result.scalars().all()
+    except SQLAlchemyError:
+        logger.exception("Помилка при отриманні історії студента", extra={"student_id": student_id})
+        return None
 
 
 # Функции для работы с учителями
 async def get_all_teachers():
     """Получить всех активных учителей"""
     try:
-        async with SessionLocal() as session:
+        async with new_session() as session:
             query = select(Teacher).where(Teacher.is_active == True)
             result = await session.execute(query)
             teachers = result.scalars().all()
             return teachers
-    except SQLAlchemyError as e:
-        print(f"Ошибка при получении списка учителей: {e}")
+    except SQLAlchemyError:
+        logger.exception("Ошибка при получении списка учителей")
         return []
 
 
 async def get_teacher_by_id(telegram_id: int):
     """Получить учителя по Telegram ID"""
     try:
-        async with SessionLocal() as session:
+        async with new_session() as session:
             query = select(Teacher).where(Teacher.telegram_id == str(telegram_id))
             result = await session.execute(query)
             teacher = result.scalars().first()
             return teacher
-    except SQLAlchemyError as e:
-        print(f"Ошибка при получении учителя: {e}")
+    except SQLAlchemyError:
+        logger.exception("Ошибка при получении учителя", extra={"telegram_id": telegram_id})
         return None
 
 
 async def add_teacher(telegram_id: int, username: str, full_name: str):
     """Добавить нового учителя"""
     try:
-        async with SessionLocal() as session:
+        async with new_session() as session:
             teacher = Teacher(
                 telegram_id=str(telegram_id),
                 username=username,
@@ -114,15 +393,15 @@ async def add_teacher(telegram_id: int, username: str, full_name: str):
             session.add(teacher)
             await session.commit()
             return True
-    except SQLAlchemyError as e:
-        print(f"Ошибка при добавлении учителя: {e}")
+    except SQLAlchemyError:
+        logger.exception("Ошибка при добавлении учителя", extra={"telegram_id": telegram_id})
         return False
 
 
 async def deactivate_teacher(telegram_id: int):
     """Деактивировать учителя"""
     try:
-        async with SessionLocal() as session:
+        async with new_session() as session:
             query = select(Teacher).where(Teacher.telegram_id == str(telegram_id))
             result = await session.execute(query)
             teacher = result.scalars().first()
@@ -132,12 +411,318 @@ async def deactivate_teacher(telegram_id: int):
                 await session.commit()
                 return True
             return False
-    except SQLAlchemyError as e:
-        print(f"Ошибка при деактивации учителя: {e}")
+    except SQLAlchemyError:
+        logger.exception("Ошибка при деактивации учителя", extra={"telegram_id": telegram_id})
         return False
 
 
 async def is_teacher(telegram_id: int):
     """Проверить, является ли пользователь учителем"""
     teacher = await get_teacher_by_id(telegram_id)
-    return teacher is not None and teacher.is_active
\ No newline at end of file
+    return teacher is not None and teacher.is_active
+
+# Функції для розсилок
+def _broadcast_recipients_query(audience: str, created_at: datetime, active_days: int):
+    """Відправники, що писали боту до створення розсилки (знімок не змінюється при відновленні)."""
+    query = select(CuratorMessage.sender_id).where(CuratorMessage.message_time <= created_at)
+    if audience in ("students", "active"):
+        query = query.where(CuratorMessage.sender_type == "student")
+    if audience == "active":
+        query = query.where(CuratorMessage.message_time >= created_at - timedelta(days=active_days))
+    return query.distinct()
+
+
+async def create_broadcast_job(text: str, audience: str, created_by: int, active_days: int = 30):
+    """Створює розсилку і рахує кількість отримувачів"""
+    try:
+        async with new_session() as session:
+            job = BroadcastJob(text=text, audience=audience, created_by=str(created_by),
+                               created_at=datetime.utcnow())
+            recipients = _broadcast_recipients_query(audience, job.created_at, active_days).subquery()
+            job.total = (await session.execute(select(func.count()).select_from(recipients))).scalar_one()
+            session.add(job)
+            await session.commit()
+            await session.refresh(job)
+            return job
+    except SQLAlchemyError:
+        logger.exception("Помилка при створенні розсилки")
+        return None
+
+
+async def get_broadcast_job(job_id: int):
+    try:
+        async with new_session() as session:
+            return await session.get(BroadcastJob, job_id)
+    except SQLAlchemyError:
+        logger.exception("Помилка при отриманні розсилки", extra={"job_id": job_id})
+        return None
+
+
+async def get_broadcast_jobs(status: str = None):
+    """Розсилки з указаним статусом (або всі), від найновішої"""
+    try:
+        async with new_session() as session:
+            query = select(BroadcastJob).order_by(BroadcastJob.id.desc())
+            if status:
+                query = query.where(BroadcastJob.status == status)
+            result = await session.execute(query)
+            return result.scalars().all()
+    except SQLAlchemyError:
+        logger.exception("Помилка при отриманні розсилок")
+        return []
+
+
+async def get_broadcast_recipients(job, after: str = None, limit: int = 200, active_days: int = 30):
+    """Наступна сторінка отримувачів після курсора, впорядкована за sender_id"""
+    try:
+        async with new_session() as session:
+            query = _broadcast_recipients_query(job.audience, job.created_at, active_days)
+            if after is not None:
+                query = query.where(CuratorMessage.sender_id > after)
+            result = await session.execute(query.order_by(CuratorMessage.sender_id).limit(limit))
+            return result.scalars().all()
+    except SQLAlchemyError:
+        logger.exception("Помилка при отриманні отримувачів розсилки", extra={"job_id": job.id})
+        return None
+
+
+async def update_broadcast_job(job_id: int, only_status: str = None, **fields):
+    """Зберігає прогрес або статус розсилки.
+
+    З only_status запис змінюється лише в розсилці з таким поточним статусом;
+    False, якщо розсилки немає або статус уже інший.
+    """
+    try:
+        async with new_session() as session:
+            query = update(BroadcastJob).where(BroadcastJob.id == job_id)
+            if only_status is not None:
+                query = query.where(BroadcastJob.status == only_status)
+            result = await session.execute(query.values(**fields))
+            await session.commit()
+            return result.rowcount == 1
+    except SQLAlchemyError:
+        logger.exception("Помилка при оновленні розсилки", extra={"job_id": job_id})
+        return False
+
+
+# Функції для шаблонних відповідей
+async def get_snippets():
+    """Усі активні шаблони"""
+    try:
+        async with new_session() as session:
+            query = select(Snippet).where(Snippet.is_active == True).order_by(Snippet.id)
+            result = await session.execute(query)
+            return result.scalars().all()
+    except SQLAlchemyError:
+        logger.exception("Помилка при отриманні шаблонів")
+        return []
+
+
+async def add_snippet(title: str, text: str, created_by: int):
+    """Додає шаблон і повертає його (None при помилці)"""
+    try:
+        async with new_session() as session:
+            snippet = Snippet(title=title, text=text, created_by=str(created_by))
+            session.add(snippet)
+            await session.commit()
+            await session.refresh(snippet)
+            return snippet
+    except SQLAlchemyError:
+        logger.exception("Помилка при додаванні шаблону")
+        return None
+
+
+async def deactivate_snippet(snippet_id: int):
+    """Вимикає шаблон; False, якщо його немає"""
+    try:
+        async with new_session() as session:
+            snippet = await session.get(Snippet, snippet_id)
+            if snippet is None or not snippet.is_active:
+                return False
+            snippet.is_active = False
+            await session.commit()
+            return True
+    except SQLAlchemyError:
+        logger.exception("Помилка при видаленні шаблону", extra={"snippet_id": snippet_id})
+        return False
+
+
+# Функції для планувальника і звітів
+async def get_task_last_run(name: str, default: datetime):
+    """Час останнього запуску задачі; при першому зверненні записує default. None при помилці."""
+    try:
+        async with new_session() as session:
+            task = await session.get(ScheduledTask, name)
+            if task is not None:
+                return task.last_run_at
+            session.add(ScheduledTask(name=name, last_run_at=default))
+            await session.commit()
+            return default
+    except IntegrityError:
+        # Рядок щойно створив інший процес
+        return await get_task_last_run(name, default)
+    except SQLAlchemyError:
+        logger.exception("Помилка при читанні стану задачі", extra={"task": name})
+        return None
+
+
+async def claim_task_run(name: str, previous: datetime, run_at: datetime):
+    """Атомарно переносить last_run_at з previous на run_at.
+
+    False, якщо цей запуск уже забрав інший процес (або попередній екземпляр бота).
+    """
+    try:
+        async with new_session() as session:
+            result = await session.execute(
+                update(ScheduledTask)
+                .where(ScheduledTask.name == name, ScheduledTask.last_run_at == previous)
+                .values(last_run_at=run_at)
+            )
+            await session.commit()
+            return result.rowcount == 1
+    except SQLAlchemyError:
+        logger.exception("Помилка при фіксації запуску задачі", extra={"task": name})
+        return False
+
+
+async def get_bot_state(key: str):
+    """Рядок bot_state (value, updated_at); None, якщо його ще не записано або сталася помилка."""
+    try:
+        async with new_session() as session:
+            return await session.get(BotState, key)
+    except SQLAlchemyError:
+        logger.exception("Помилка при читанні стану бота", extra={"key": key})
+        return None
+
+
+async def set_bot_state(key: str, value: int):
+    try:
+        return await _insert(BotState(key=key, value=value, updated_at=datetime.utcnow()), merge=True)
+    except SQLAlchemyError:
+        logger.exception("Помилка при збереженні стану бота", extra={"key": key})
+        return False
+
+
+async def claim_bot_state(key: str, previous, value: int) -> bool:
+    """Атомарно замінює рядок previous (результат get_bot_state, None - рядка ще немає) на value.
+
+    False, якщо рядок тим часом змінив інший процес.
+    """
+    try:
+        async with new_session() as session:
+            if previous is None:
+                session.add(BotState(key=key, value=value, updated_at=datetime.utcnow()))
+                await session.commit()
+                return True
+            result = await session.execute(
+                update(BotState)
+                .where(BotState.key == key, BotState.value == previous.value,
+                       BotState.updated_at == previous.updated_at)
+                .values(value=value, updated_at=datetime.utcnow())
+            )
+            await session.commit()
+            return result.rowcount == 1
+    except IntegrityError:
+        return False
+    except SQLAlchemyError:
+        logger.exception("Помилка при захопленні стану бота", extra={"key": key})
+        return False
+
+
+async def save_pending_updates(payloads: dict):
+    """Зберігає необроблені оновлення (update_id -> JSON) для процесу-заміни."""
+    try:
+        async with new_session() as session:
+            for update_id, payload in payloads.items():
+                await session.merge(PendingUpdate(update_id=update_id, payload=payload))
+            await session.commit()
+        return True
+    except SQLAlchemyError:
+        logger.exception("Помилка при збереженні необроблених оновлень", extra={"count": len(payloads)})
+        return False
+
+
+async def take_pending_updates():
+    """Забирає (читає й видаляє однією транзакцією) необроблені оновлення попереднього процесу."""
+    try:
+        async with new_session() as session:
+            result = await session.execute(select(PendingUpdate).order_by(PendingUpdate.update_id))
+            pending = result.scalars().all()
+            if pending:
+                await session.execute(delete(PendingUpdate).where(
+                    PendingUpdate.update_id.in_([row.update_id for row in pending])
+                ))
+            await session.commit()
+            return pending
+    except SQLAlchemyError:
+        logger.exception("Помилка при читанні необроблених оновлень")
+        return []
+
+
+async def get_fsm_records():
+    """Усі збережені стани FSM (None при помилці)."""
+    try:
+        async with new_session() as session:
+            result = await session.execute(select(FsmRecord))
+            return result.scalars().all()
+    except SQLAlchemyError:
+        logger.exception("Помилка при читанні станів FSM")
+        return None
+
+
+async def save_fsm_record(key: str, **fields):
+    """Вставляє або оновлює стан FSM за ключем."""
+    try:
+        return await _insert(FsmRecord(key=key, updated_at=datetime.utcnow(), **fields), merge=True)
+    except SQLAlchemyError:
+        logger.exception("Помилка при збереженні стану FSM", extra={"key": key})
+        return False
+
+
+async def get_curator_activity(since: datetime, until: datetime):
+    """Кількість дій кожного куратора за період: рядки (curator_id, action, count)"""
+    try:
+        async with new_session() as session:
+            query = (select(CuratorLog.curator_id, CuratorLog.action, func.count())
+                     .where(CuratorLog.action_time > since, CuratorLog.action_time <= until)
+                     .group_by(CuratorLog.curator_id, CuratorLog.action))
+            result = await session.execute(query)
+            return result.all()
+    except SQLAlchemyError:
+        logger.exception("Помилка при підрахунку дій кураторів")
+        return []
+
+
+async def get_taken_requests(since: datetime, until: datetime):
+    """Запити, взяті в роботу за період: рядки (request_id, час створення, перше взяття за період)"""
+    try:
+        async with new_session() as session:
+            query = (select(StudentRequest.id, StudentRequest.created_at, func.min(CuratorLog.action_time))
+                     .join(StudentRequest, cast(StudentRequest.id, String) == CuratorLog.request_id)
+                     .where(CuratorLog.action == ACTION_TAKE,
+                            CuratorLog.action_time > since, CuratorLog.action_time <= until)
+                     .group_by(StudentRequest.id, StudentRequest.created_at))
+            result = await session.execute(query)
+            return result.all()
+    except SQLAlchemyError:
+        logger.exception("Помилка при отриманні взятих запитів")
+        return []
+
+
+async def count_period_activity(since: datetime, until: datetime):
+    """(повідомлень від студентів, нових запитів) за період; (0, 0) при помилці"""
+    try:
+        async with new_session() as session:
+            messages = await session.execute(
+                select(func.count()).select_from(CuratorMessage)
+                .where(CuratorMessage.message_time > since, CuratorMessage.message_time <= until,
+                       CuratorMessage.sender_type == "student")
+            )
+            created = await session.execute(
+                select(func.count()).select_from(StudentRequest)
+                .where(StudentRequest.created_at > since, StudentRequest.created_at <= until)
+            )
+            return messages.scalar_one(), created.scalar_one()
+    except SQLAlchemyError:
+        logger.exception("Помилка при підрахунку активності за період")
+        return 0, 0
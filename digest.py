@@ -0,0 +1,98 @@
+"""Щоденний і щотижневий звіт для адміністратора та форумів кураторів.
+
+Дії кураторів, повідомлення і нові запити читаються лише за період від
+попереднього звіту (за індексами часу), відкриті запити - знімком на момент звіту.
+"""
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from db import (
+    ACTION_TAKE, ACTION_FINISH, ACTION_HOLD, ACTION_REASSIGN,
+    count_period_activity, get_all_teachers, get_curator_activity, get_open_requests, get_taken_requests
+)
+from keyboards import STATUS_NEW, STATUS_ON_HOLD
+
+logger = logging.getLogger("bot.digest")
+
+KYIV = ZoneInfo("Europe/Kiev")
+AGE_BUCKETS = (
+    (timedelta(hours=1), "до 1 год"),
+    (timedelta(days=1), "1-24 год"),
+    (timedelta(days=7), "1-7 днів"),
+    (None, "понад 7 днів"),
+)
+ACTION_NAMES = {ACTION_TAKE: "взяв", ACTION_FINISH: "завершив", ACTION_HOLD: "на утримання",
+                ACTION_REASSIGN: "переназначив"}
+# Скільки завислих запитів перелічувати поіменно
+STALE_LIST_LIMIT = 10
+
+
+def _local(moment: datetime) -> str:
+    return moment.replace(tzinfo=timezone.utc).astimezone(KYIV).strftime("%d.%m %H:%M")
+
+
+def _age_bucket(age: timedelta) -> str:
+    for limit, name in AGE_BUCKETS:
+        if limit is None or age < limit:
+            return name
+
+
+async def build_digest(title: str, since: datetime, until: datetime, sla_minutes: int, stale_hours: int) -> str:
+    """Текст звіту за період (since, until]; часи - UTC без часового поясу."""
+    sla = timedelta(minutes=sla_minutes)
+    messages, created = await count_period_activity(since, until)
+    open_requests = await get_open_requests()
+    activity = await get_curator_activity(since, until)
+    taken = await get_taken_requests(since, until)
+    names = {teacher.telegram_id: teacher.full_name for teacher in await get_all_teachers()}
+
+    lines = [f"📊 {title}: {_local(since)} - {_local(until)}",
+             f"Повідомлень від студентів: {messages}, нових запитів: {created}"]
+
+    ages = Counter(_age_bucket(until - (request.created_at or until)) for request in open_requests)
+    statuses = Counter(request.status for request in open_requests)
+    lines.append(f"\n📂 Відкриті запити: {len(open_requests)}")
+    if open_requests:
+        lines.append("  за віком: " + ", ".join(f"{name} {ages[name]}" for _, name in AGE_BUCKETS if ages[name]))
+        lines.append("  за статусом: " + ", ".join(f"{status} {count}" for status, count in statuses.most_common()))
+
+    per_curator = defaultdict(Counter)
+    for curator_id, action, count in activity:
+        per_curator[curator_id][action] += count
+    lines.append("\n👩‍🏫 Куратори за період:")
+    if not per_curator:
+        lines.append("  дій не було")
+    for curator_id, actions in sorted(per_curator.items(), key=lambda item: -item[1][ACTION_FINISH]):
+        counts = ", ".join(f"{ACTION_NAMES.get(action, action)} {count}" for action, count in actions.most_common())
+        lines.append(f"  {names.get(curator_id, curator_id)}: {counts}")
+
+    reactions = [taken_at - created_at for _, created_at, taken_at in taken if created_at and taken_at]
+    breaches = sum(1 for reaction in reactions if reaction > sla)
+    waiting = sum(1 for request in open_requests
+                  if request.status == STATUS_NEW and request.created_at and until - request.created_at > sla)
+    lines.append(f"\n⏱ SLA (реакція до {sla_minutes} хв): порушень за період {breaches} з {len(reactions)}, "
+                 f"зараз чекають довше {waiting}")
+    if reactions:
+        average = sum(reactions, timedelta()) / len(reactions)
+        lines.append(f"  середній час реакції: {int(average.total_seconds() // 60)} хв")
+
+    stale_before = until - timedelta(hours=stale_hours)
+    stale = [request for request in open_requests
+             if request.status == STATUS_ON_HOLD and (request.updated_at or until) < stale_before]
+    lines.append(f"\n⏸ На утриманні понад {stale_hours} год: {len(stale)}")
+    for request in stale[:STALE_LIST_LIMIT]:
+        curator = request.curator_username and f"@{request.curator_username}" or request.curator_name or "-"
+        lines.append(f"  #{request.id} {request.student_name or request.student_id} ➤ {curator}, "
+                     f"з {_local(request.updated_at)}")
+    return "\n".join(lines)
+
+
+async def send_digest(bot, chat_ids, text: str):
+    """Надсилає звіт у кожен чат; помилка в одному чаті не зупиняє решту."""
+    for chat_id in chat_ids:
+        try:
+            await bot.send_message(chat_id, text)
+        except Exception as e:
+            logger.warning("Не вдалося надіслати звіт: %s", e, extra={"chat_id": chat_id})
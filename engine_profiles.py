@@ -0,0 +1,151 @@
+"""Профілі рушія БД, що обираються за DATABASE_URL.
+
+postgres - пул з'єднань з pre-ping і кешем підготовлених запитів asyncpg;
+sqlite   - WAL, synchronous=NORMAL і єдиний писач, що об'єднує вставки в спільні транзакції;
+default  - налаштування SQLAlchemy за замовчуванням (DB_PROFILE=default вмикає його примусово).
+"""
+import asyncio
+import contextvars
+import logging
+import os
+
+from sqlalchemy import event
+
+logger = logging.getLogger("bot.db")
+
+PROFILES = ("postgres", "sqlite", "default")
+
+
+def resolve_profile(url: str, profile: str = None) -> str:
+    profile = profile or os.getenv("DB_PROFILE")
+    if profile:
+        if profile not in PROFILES:
+            raise ValueError(f"Невідомий профіль БД: {profile}")
+        return profile
+    if url.startswith("postgresql"):
+        return "postgres"
+    if url.startswith("sqlite"):
+        return "sqlite"
+    return "default"
+
+
+def engine_kwargs(profile: str) -> dict:
+    """Аргументи create_async_engine для профілю."""
+    if profile == "postgres":
+        return {
+            "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+            "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+            "pool_pre_ping": True,
+            "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+            "connect_args": {
+                "prepared_statement_cache_size": int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500")),
+            },
+        }
+    if profile == "sqlite":
+        return {"connect_args": {"timeout": 30}}
+    return {}
+
+
+def install_sqlite_pragmas(engine, url: str):
+    """Вмикає WAL для кожного нового з'єднання з файловою SQLite базою."""
+    in_memory = ":memory:" in url or url.rstrip("/").endswith("sqlite+aiosqlite:")
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not in_memory:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
+
+class WriteQueue:
+    """Єдиний писач для SQLite.
+
+    Обробники ставлять ORM-об'єкти в чергу й чекають результату; фонова задача
+    забирає все, що накопичилося (до max_batch), і записує однією транзакцією.
+    Так SQLite не бореться за блокування запису, а commit робиться раз на пачку.
+    Об'єкти з merge=True зливаються за первинним ключем (вставка або оновлення).
+    Якщо транзакція пачки не вдалася, записи повторюються по одному, тож помилка
+    одного рядка не губить решту.
+    """
+
+    def __init__(self, session_factory, max_batch: int = 200):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self._queue = None
+        self._worker = None
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = self._queue or asyncio.Queue()
+            # Порожній контекст: інакше воркер успадкує контекстні змінні (ідентифікатори
+            # для логів, трасу профілювання) того обробника, який першим поставив запис
+            self._worker = contextvars.Context().run(asyncio.create_task, self._run())
+
+    async def submit(self, entry, merge: bool = False) -> bool:
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((entry, merge, future))
+        return await future
+
+    async def _commit(self, batch):
+        async with self.session_factory() as session:
+            for entry, merge, _ in batch:
+                if merge:
+                    await session.merge(entry)
+                else:
+                    session.add(entry)
+            await session.commit()
+
+    async def _write(self, batch):
+        """Результат запису для кожного елемента пачки."""
+        try:
+            await self._commit(batch)
+            return [True] * len(batch)
+        except Exception:
+            if len(batch) == 1:
+                logger.exception("Помилка запису в БД")
+                return [False]
+            logger.warning("Пакетний запис не вдався, записи повторюються по одному",
+                           extra={"batch_size": len(batch)})
+        results = []
+        for item in batch:
+            try:
+                await self._commit([item])
+                results.append(True)
+            except Exception:
+                logger.exception("Помилка запису в БД", extra={"entry": type(item[0]).__name__})
+                results.append(False)
+        return results
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            results = []
+            try:
+                results = await self._write(batch)
+            finally:
+                # І при скасуванні воркера жоден обробник не чекає результату вічно
+                for index, (_, _, future) in enumerate(batch):
+                    if not future.done():
+                        future.set_result(results[index] if index < len(results) else False)
+                    self._queue.task_done()
+
+    async def flush(self):
+        """Чекає, доки будуть записані всі поставлені в чергу об'єкти."""
+        if self._queue is not None and self._worker is not None and not self._worker.done():
+            await self._queue.join()
+
+    async def close(self):
+        await self.flush()
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
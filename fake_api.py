@@ -0,0 +1,265 @@
+"""Локальний симулятор Telegram Bot API для навантажувальних тестів.
+
+Запуск окремо:
+    python fake_api.py --port 8081 --latency 0.05 --error-rate 0.01
+і потім бот з TELEGRAM_API_URL=http://127.0.0.1:8081
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter, defaultdict, deque
+
+from aiohttp import web, ClientSession
+
+BOT_USER = {"id": 100000001, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+# Методи, які ніколи не отримують штучний 429, щоб не ламати сам цикл отримання оновлень
+SERVICE_METHODS = {"getme", "getupdates", "setwebhook", "deletewebhook", "close", "logout"}
+
+
+class FakeBotAPI:
+    """Імітує підмножину Bot API, яку використовує бот.
+
+    latency/jitter - затримка відповіді в секундах,
+    error_rate - ймовірність відповіді 429 на будь-який виклик,
+    chat_rate_limit - максимум повідомлень на секунду в один чат (0 - без обмеження),
+    global_rate_limit - максимум викликів на секунду сумарно (0 - без обмеження),
+    retry_after - значення retry_after у відповідях 429,
+    blocked_chats - чати, що "заблокували" бота (відповідь 403).
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 chat_rate_limit: int = 0, global_rate_limit: int = 0, retry_after: int = 1,
+                 blocked_chats=(), host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.chat_rate_limit = chat_rate_limit
+        self.global_rate_limit = global_rate_limit
+        self.retry_after = retry_after
+        self.blocked_chats = set(blocked_chats)
+        self.host = host
+        self.port = port
+
+        self.calls = Counter()
+        self.rate_limited = Counter()
+        self.webhook_url = None
+
+        self._message_id = 0
+        self._thread_id = 0
+        self._update_id = 0
+        self._updates = []
+        self._new_updates = asyncio.Event()
+        self._chat_sends = defaultdict(deque)
+        self._global_sends = deque()
+        self._runner = None
+        self._client = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        return self
+
+    async def stop(self):
+        if self._client:
+            await self._client.close()
+        if self._runner:
+            await self._runner.cleanup()
+
+    def next_message_id(self) -> int:
+        self._message_id += 1
+        return self._message_id
+
+    def next_update_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+    async def push_update(self, update: dict):
+        """Доставляє оновлення боту: через вебхук, якщо він встановлений, інакше через getUpdates."""
+        if self.webhook_url:
+            if self._client is None:
+                self._client = ClientSession()
+            async with self._client.post(self.webhook_url, json=update) as response:
+                await response.read()
+            return
+        self._updates.append(update)
+        self._new_updates.set()
+
+    def reset_stats(self):
+        self.calls.clear()
+        self.rate_limited.clear()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        params = await self._read_params(request)
+        self.calls[method] += 1
+
+        if method not in SERVICE_METHODS:
+            delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+            if delay:
+                await asyncio.sleep(delay)
+            if self._is_rate_limited(params):
+                self.rate_limited[method] += 1
+                return web.json_response({
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }, status=429)
+            if params.get("chat_id") in self.blocked_chats:
+                return web.json_response({
+                    "ok": False,
+                    "error_code": 403,
+                    "description": "Forbidden: bot was blocked by the user",
+                }, status=403)
+
+        handler = getattr(self, f"_api_{method}", None)
+        result = await handler(params) if handler else True
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    async def _read_params(request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            raw = await request.json()
+        else:
+            raw = dict(await request.post())
+        params = {}
+        for key, value in raw.items():
+            if isinstance(value, str):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            params[key] = value
+        return params
+
+    def _is_rate_limited(self, params: dict) -> bool:
+        if self.error_rate and random.random() < self.error_rate:
+            return True
+        now = time.monotonic()
+        if self.global_rate_limit and self._window_full(self._global_sends, self.global_rate_limit, now):
+            return True
+        chat_id = params.get("chat_id")
+        if self.chat_rate_limit and chat_id is not None:
+            return self._window_full(self._chat_sends[chat_id], self.chat_rate_limit, now)
+        return False
+
+    @staticmethod
+    def _window_full(sends: deque, limit: int, now: float) -> bool:
+        """Ковзне вікно в одну секунду: True, якщо ліміт уже вичерпано."""
+        while sends and now - sends[0] > 1.0:
+            sends.popleft()
+        if len(sends) >= limit:
+            return True
+        sends.append(now)
+        return False
+
+    def _message(self, params: dict) -> dict:
+        chat_id = int(params["chat_id"])
+        message = {
+            "message_id": self.next_message_id(),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private"},
+            "from": BOT_USER,
+            "text": str(params.get("text", "")),
+        }
+        if params.get("message_thread_id"):
+            message["message_thread_id"] = int(params["message_thread_id"])
+            message["is_topic_message"] = True
+        if params.get("reply_markup"):
+            message["reply_markup"] = params["reply_markup"]
+        return message
+
+    async def _api_getme(self, params: dict):
+        return BOT_USER
+
+    async def _api_sendmessage(self, params: dict):
+        return self._message(params)
+
+    async def _api_senddocument(self, params: dict):
+        return self._message(params)
+
+    async def _api_createforumtopic(self, params: dict):
+        self._thread_id += 1
+        return {
+            "message_thread_id": self._thread_id,
+            "name": params.get("name", ""),
+            "icon_color": int(params.get("icon_color") or 0x6FB9F0),
+        }
+
+    async def _api_editforumtopic(self, params: dict):
+        return True
+
+    async def _api_closeforumtopic(self, params: dict):
+        return True
+
+    async def _api_editmessagereplymarkup(self, params: dict):
+        return True
+
+    async def _api_setwebhook(self, params: dict):
+        self.webhook_url = params.get("url") or None
+        return True
+
+    async def _api_deletewebhook(self, params: dict):
+        self.webhook_url = None
+        if params.get("drop_pending_updates"):
+            self._updates.clear()
+        return True
+
+    async def _api_getupdates(self, params: dict):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        limit = int(params.get("limit") or 100)
+        if offset:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+
+async def serve(args):
+    api = FakeBotAPI(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                     chat_rate_limit=args.chat_rate_limit, global_rate_limit=args.global_rate_limit,
+                     retry_after=args.retry_after,
+                     host=args.host, port=args.port)
+    await api.start()
+    print(f"Симулятор Bot API слухає на {api.url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.stop()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Локальний симулятор Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="затримка відповіді, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="випадкова добавка до затримки, с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="ймовірність відповіді 429")
+    parser.add_argument("--chat-rate-limit", type=int, default=0, help="повідомлень/с на чат до 429")
+    parser.add_argument("--global-rate-limit", type=int, default=0, help="викликів/с сумарно до 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve(parse_args()))
+    except KeyboardInterrupt:
+        pass
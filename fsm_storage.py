@@ -0,0 +1,66 @@
+"""Сховище FSM, що переживає перезапуск і заміну процесу бота.
+
+Стани тримаються в пам'яті, як у MemoryStorage (читання на кожне оновлення не йде
+в БД), а кожна зміна одразу записується в таблицю fsm_states. load() перечитує
+всі стани з БД: під час прогріву і коли процес перебирає опитування в попереднього
+(див. lifecycle.py), тож куратор, який натиснув "Відповісти" в старому процесі,
+надсилає відповідь уже новому.
+"""
+import json
+import logging
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage, MemoryStorageRecord
+
+from db import get_fsm_records, save_fsm_record
+
+logger = logging.getLogger("bot.fsm")
+
+
+class DbStorage(MemoryStorage):
+    def __init__(self):
+        super().__init__()
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_business_connection_id=True,
+                                             with_destiny=True)
+
+    async def load(self):
+        """Замінює стани в пам'яті збереженими в БД; при помилці БД лишає наявні."""
+        records = await get_fsm_records()
+        if records is None:
+            return
+        self.storage.clear()
+        for record in records:
+            data = json.loads(record.data or "{}")
+            if record.state is None and not data:
+                continue
+            key = StorageKey(
+                bot_id=record.bot_id, chat_id=record.chat_id, user_id=record.user_id,
+                thread_id=record.thread_id, business_connection_id=record.business_connection_id,
+                destiny=record.destiny,
+            )
+            self.storage[key] = MemoryStorageRecord(data=data, state=record.state)
+        logger.info("Стани FSM завантажено", extra={"count": len(self.storage)})
+
+    async def _save(self, key: StorageKey):
+        record = self.storage[key]
+        await save_fsm_record(
+            self.key_builder.build(key),
+            bot_id=key.bot_id, chat_id=key.chat_id, user_id=key.user_id, thread_id=key.thread_id,
+            business_connection_id=key.business_connection_id, destiny=key.destiny,
+            state=record.state, data=json.dumps(record.data, ensure_ascii=False, default=str),
+        )
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        if state == self.storage[key].state:
+            return
+        await super().set_state(key, state)
+        await self._save(key)
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if data == self.storage[key].data:
+            return
+        await super().set_data(key, data)
+        await self._save(key)
@@ -0,0 +1,77 @@
+"""Історія попередніх запитів студента в треді кураторів.
+
+Сторінки читаються з БД за ключем (message_time, id): курсор останнього показаного
+повідомлення кодується в callback-дані кнопки "Старіші", тож кожна сторінка - один
+індексований запит без OFFSET. Повідомлення минулих запитів не змінюються, тому
+готові сторінки тримаються в невеликому LRU і гортання назад не ходить у БД.
+"""
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from db import get_student_history
+
+PAGE_SIZE = 10
+# Довгі повідомлення обрізаються, щоб сторінка вміщалася в одне повідомлення Telegram
+MAX_TEXT = 300
+EPOCH = datetime(1970, 1, 1)
+KYIV = ZoneInfo("Europe/Kiev")
+
+
+def encode_time(moment: datetime) -> int:
+    """message_time (UTC без часового поясу) у ціле число мікросекунд для callback-даних."""
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+
+def decode_time(value: int) -> datetime:
+    return EPOCH + timedelta(microseconds=value)
+
+
+class PageCache:
+    """LRU сторінок історії: ключ - (студент, поточний запит, курсор)."""
+
+    def __init__(self, max_pages: int = 256):
+        self.max_pages = max_pages
+        self.stats = Counter()
+        self._pages = OrderedDict()
+
+    async def get(self, student_id: int, exclude_request_id: str, cursor=None):
+        """Повертає (повідомлення, курсор наступної сторінки або None); None при помилці БД."""
+        key = (student_id, exclude_request_id, cursor)
+        page = self._pages.get(key)
+        if page is not None:
+            self._pages.move_to_end(key)
+            self.stats["hits"] += 1
+            return page
+
+        self.stats["misses"] += 1
+        before = (decode_time(cursor[0]), cursor[1]) if cursor else None
+        rows = await get_student_history(student_id, exclude_request_id, before, PAGE_SIZE + 1)
+        if rows is None:
+            return None
+        next_cursor = None
+        if len(rows) > PAGE_SIZE:
+            rows = rows[:PAGE_SIZE]
+            next_cursor = (encode_time(rows[-1].message_time), rows[-1].id)
+        messages = [(row.request_id, row.sender_type, row.message_text, row.message_time) for row in rows]
+
+        page = self._pages[key] = (messages, next_cursor)
+        if len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+        return page
+
+
+def render_page(messages, page_number: int) -> str:
+    """Сторінка історії в хронологічному порядку, згрупована за запитами."""
+    lines = [f"📜 Історія студента, сторінка {page_number}"]
+    current_request = None
+    for request_id, sender_type, text, moment in reversed(messages):
+        if request_id != current_request:
+            current_request = request_id
+            lines.append(f"\n🗂 Запит #{request_id}")
+        if len(text) > MAX_TEXT:
+            text = text[:MAX_TEXT - 3] + "..."
+        icon = "👤" if sender_type == "student" else "🎓"
+        local_time = moment.replace(tzinfo=timezone.utc).astimezone(KYIV)
+        lines.append(f"[{local_time.strftime('%d.%m.%Y %H:%M')}] {icon} {text}")
+    return "\n".join(lines)
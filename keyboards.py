@@ -0,0 +1,120 @@
+"""Клавіатури запитів і компактний формат callback-даних.
+
+Callback-дані мають вигляд "r:<дія>:<id запиту>", наприклад "r:1:1234",
+для шаблонних відповідей - "s:<id запиту>:<id шаблону>", для історії студента -
+"h:<id запиту>:<сторінка>:<час>:<id>", де (час, id) - курсор останнього показаного повідомлення.
+Клавіатура залежить лише від статусу й id запиту, тож готові об'єкти кешуються.
+"""
+from enum import IntEnum
+from functools import lru_cache
+
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+STATUS_NEW = "Очікує обробки"
+STATUS_IN_WORK = "У роботі"
+STATUS_ON_HOLD = "Очікує"
+STATUS_DONE = "Завершено"
+
+
+class Action(IntEnum):
+    TAKE = 1
+    REPLY = 2
+    FINISH = 3
+    HOLD = 4
+    REASSIGN = 5
+
+
+class RequestCallback(CallbackData, prefix="r"):
+    action: Action
+    request_id: int
+
+
+class SnippetCallback(CallbackData, prefix="s"):
+    request_id: int
+    snippet_id: int
+
+
+class HistoryCallback(CallbackData, prefix="h"):
+    request_id: int
+    # 0 - кнопка на повідомленні запиту (історія надсилається окремим повідомленням),
+    # 1 і далі - гортання вже показаної історії
+    page: int
+    before_time: int = 0
+    before_id: int = 0
+
+
+BUTTON_TEXT = {
+    Action.TAKE: "Взяти в роботу",
+    Action.REPLY: "Відповісти",
+    Action.FINISH: "Завершити діалог",
+    Action.HOLD: "Поставити на утримання",
+    Action.REASSIGN: "Переназначити",
+}
+
+# Розкладка кнопок для кожного статусу запиту
+LAYOUTS = {
+    STATUS_NEW: [[Action.TAKE]],
+    STATUS_IN_WORK: [[Action.REPLY, Action.FINISH], [Action.HOLD, Action.REASSIGN]],
+    STATUS_ON_HOLD: [[Action.REPLY, Action.FINISH], [Action.TAKE, Action.REASSIGN]],
+}
+
+
+@lru_cache(maxsize=4096)
+def request_keyboard(status: str, request_id: int):
+    """Клавіатура для запиту в указаному статусі (None, якщо кнопок немає)."""
+    layout = LAYOUTS.get(status)
+    if layout is None:
+        return None
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text=BUTTON_TEXT[action],
+                    callback_data=RequestCallback(action=action, request_id=request_id).pack()
+                )
+                for action in row
+            ]
+            for row in layout
+        ]
+    )
+
+
+def with_snippets(keyboard, request_id: int, snippets):
+    """Додає до клавіатури запиту кнопки шаблонних відповідей: snippets - пари (id, заголовок)."""
+    rows = [
+        [InlineKeyboardButton(
+            text=f"💡 {title}",
+            callback_data=SnippetCallback(request_id=request_id, snippet_id=snippet_id).pack()
+        )]
+        for snippet_id, title in snippets
+    ]
+    if not rows:
+        return keyboard
+    return InlineKeyboardMarkup(inline_keyboard=(keyboard.inline_keyboard if keyboard else []) + rows)
+
+
+def with_history(keyboard, request_id: int):
+    """Додає до клавіатури запиту кнопку історії студента."""
+    row = [InlineKeyboardButton(
+        text="📜 Історія",
+        callback_data=HistoryCallback(request_id=request_id, page=0).pack()
+    )]
+    return InlineKeyboardMarkup(inline_keyboard=(keyboard.inline_keyboard if keyboard else []) + [row])
+
+
+def history_keyboard(request_id: int, page: int, next_cursor):
+    """Кнопки гортання історії: на першу сторінку і до старіших повідомлень."""
+    row = []
+    if page > 1:
+        row.append(InlineKeyboardButton(
+            text="⏮ Найновіші",
+            callback_data=HistoryCallback(request_id=request_id, page=1).pack()
+        ))
+    if next_cursor:
+        row.append(InlineKeyboardButton(
+            text="Старіші ▶",
+            callback_data=HistoryCallback(request_id=request_id, page=page + 1,
+                                          before_time=next_cursor[0], before_id=next_cursor[1]).pack()
+        ))
+    return InlineKeyboardMarkup(inline_keyboard=[row]) if row else None
@@ -0,0 +1,265 @@
+"""Плавна зупинка й заміна процесу бота без втрачених оновлень.
+
+Опитувати Telegram може лише власник оренди polling_lease у bot_state. Процес-заміна
+після перевірки схеми БД чекає, доки попередній процес віддасть оренду (або вона
+застаріє, якщо той упав). Якщо попередник працював уже після прогріву заміни,
+заміна перечитує з БД відкриті запити, ростер і стани FSM: вони могли змінитися.
+
+На SIGTERM/SIGINT бот:
+  1. перестає забирати оновлення;
+  2. чекає, доки обробники, розсилки й задачі планувальника, що вже працюють,
+     завершаться (не довше SHUTDOWN_TIMEOUT), а не обриває їх посередині;
+  3. обробники, що не встигли, скасовує, а їхні оновлення зберігає в pending_updates:
+     aiogram уже підтвердив їх Telegram, тож повторно їх ніхто не надішле;
+  4. зберігає update_id останнього взятого оновлення, підтверджує offset і віддає оренду;
+  5. дописує чергу записів у БД і закриває з'єднання.
+Процес-заміна пропускає оновлення з update_id не більшим за збережений (Telegram
+міг видати їх повторно), а збережені необроблені подає сам.
+
+Гарантія для скасованих обробників - "хоча б раз": процес-заміна виконує оновлення
+з початку, а вже зроблене старим процесом не відкочується. Можливі наслідки:
+повторне повідомлення студенту чи в тему, зайвий рядок у curator_logs (і звітах),
+тема форуму без запиту, якщо обробник скасовано між створенням теми і записом
+запиту в БД. Тому SHUTDOWN_TIMEOUT варто тримати більшим за типовий час обробника.
+"""
+import asyncio
+import json
+import logging
+import random
+import signal
+from collections import Counter
+from contextlib import suppress
+from datetime import datetime, timedelta
+
+from aiogram import BaseMiddleware
+
+from db import claim_bot_state, get_bot_state, save_pending_updates, set_bot_state, take_pending_updates
+
+logger = logging.getLogger("bot.lifecycle")
+
+UPDATES_OFFSET = "updates_offset"
+POLLING_LEASE = "polling_lease"
+# Після тижня без оновлень Telegram починає update_id з випадкового числа,
+# тож старий offset не може відсікати нові оновлення
+OFFSET_TTL = timedelta(hours=1)
+# Власник оновлює оренду кожні LEASE_RENEW с; не оновлена довше за LEASE_TTL - власник упав
+LEASE_TTL = timedelta(seconds=60)
+LEASE_RENEW = 20
+LEASE_POLL = 0.5
+# Значення оренди, яку власник віддав сам
+RELEASED = 0
+
+
+class Lifecycle(BaseMiddleware):
+    def __init__(self):
+        self.stats = Counter()
+        self.last_update_id = None
+        self.offset = None
+        self.stopping = False
+        self.started_at = datetime.utcnow()
+        # update_id -> (оновлення, задача, що його обробляє)
+        self._running = {}
+        # update_id -> JSON необробленого оновлення попереднього процесу
+        self._replay = {}
+        self._replay_tasks = set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._wake = asyncio.Event()
+        self._lease = None
+        # Оренду перехопив інший процес: стан і оренда вже не наші
+        self._lease_lost = False
+        self._renew_task = None
+        self._stop_task = None
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._running)
+
+    async def __call__(self, handler, event, data):
+        """Зовнішній middleware: запам'ятовує оновлення в обробці й останній взятий update_id."""
+        if self.last_update_id is None or event.update_id > self.last_update_id:
+            self.last_update_id = event.update_id
+        self._running[event.update_id] = (event, asyncio.current_task())
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self._running.pop(event.update_id, None)
+            if not self._running:
+                self._idle.set()
+
+    async def skip_replayed(self, handler, event, data):
+        """Middleware після прогріву: пропускає оновлення, які вже обробив попередній процес."""
+        if self.offset is not None and event.update_id <= self.offset:
+            # Необроблене попередником подається один раз: від Telegram або з replay()
+            if self._replay.pop(event.update_id, None) is None:
+                self.stats["skipped"] += 1
+                logger.info("Оновлення вже оброблене попереднім процесом", extra={"update_id": event.update_id})
+                return None
+        return await handler(event, data)
+
+    async def take_over(self, dispatcher, startup, reload) -> bool:
+        """Чекає оренди опитування; False, якщо процес зупинили раніше.
+
+        Якщо попередній власник працював після нашого старту, то після прогріву
+        викликає reload(): завантажений прогрівом стан міг застаріти.
+        """
+        await startup.schema_ready.wait()
+        previous = await self._acquire_lease()
+        if self._lease is None:
+            return False
+        self._renew_task = asyncio.create_task(self._renew(dispatcher))
+        if previous is not None and previous.updated_at > self.started_at:
+            await startup.ready.wait()
+            await reload()
+            logger.info("Стан перечитано після передачі опитування")
+
+        state = await get_bot_state(UPDATES_OFFSET)
+        if state is not None and datetime.utcnow() - state.updated_at <= OFFSET_TTL:
+            self.offset = state.value
+        pending = await take_pending_updates()
+        if pending and self.offset is None:
+            logger.warning("Необроблені оновлення попереднього процесу застаріли", extra={"count": len(pending)})
+        elif pending:
+            self._replay = {row.update_id: row.payload for row in pending}
+        return True
+
+    async def _acquire_lease(self):
+        """Захоплює оренду опитування; повертає попередній рядок оренди (None, якщо його не було)."""
+        token = random.getrandbits(62) or 1
+        waiting = False
+        while not self.stopping:
+            lease = await get_bot_state(POLLING_LEASE)
+            held = (lease is not None and lease.value != RELEASED
+                    and datetime.utcnow() - lease.updated_at < LEASE_TTL)
+            if not held and await claim_bot_state(POLLING_LEASE, lease, token):
+                self._lease = token
+                logger.info("Оренду опитування отримано", extra={"waited": waiting})
+                return lease
+            if held and not waiting:
+                waiting = True
+                logger.info("Очікуємо, доки попередній процес віддасть опитування")
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wake.wait(), LEASE_POLL)
+        return None
+
+    async def _renew(self, dispatcher):
+        """Поновлює оренду; якщо її втрачено, зупиняє процес, щоб не було двох власників."""
+        renewed = datetime.utcnow()
+        while not self.stopping:
+            await asyncio.sleep(LEASE_RENEW)
+            lease = await get_bot_state(POLLING_LEASE)
+            if lease is not None and lease.value != self._lease:
+                logger.error("Оренду опитування перехопив інший процес")
+                self._lease_lost = True
+                self.request_stop(dispatcher)
+                return
+            if await claim_bot_state(POLLING_LEASE, lease, self._lease):
+                renewed = datetime.utcnow()
+            elif datetime.utcnow() - renewed >= LEASE_TTL:
+                # Для інших процесів оренда вже застаріла, тож її може забрати заміна
+                logger.error("Оренду опитування не вдається поновити")
+                self.request_stop(dispatcher)
+                return
+
+    def replay(self, dispatcher, bot):
+        """Подає необроблені оновлення попереднього процесу (після take_over)."""
+        for update_id, payload in list(self._replay.items()):
+            task = asyncio.create_task(self._replay_update(dispatcher, bot, update_id, payload))
+            self._replay_tasks.add(task)
+            task.add_done_callback(self._replay_tasks.discard)
+
+    async def _replay_update(self, dispatcher, bot, update_id, payload):
+        logger.info("Дообробка оновлення попереднього процесу", extra={"update_id": update_id})
+        self.stats["replayed"] += 1
+        try:
+            await dispatcher.feed_raw_update(bot, json.loads(payload))
+        except Exception:
+            logger.exception("Помилка дообробки оновлення", extra={"update_id": update_id})
+
+    def install_signals(self, dispatcher):
+        """Замість обробників aiogram: SIGTERM/SIGINT лише зупиняють опитування, решту робить main."""
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            # На Windows сигнали в циклі подій не підтримуються
+            with suppress(NotImplementedError):
+                loop.add_signal_handler(sig, self.request_stop, dispatcher, sig)
+
+    def request_stop(self, dispatcher, sig=None):
+        if self.stopping:
+            logger.warning("Зупинка вже триває, чекаємо завершення обробників")
+            return
+        self.stopping = True
+        self._wake.set()
+        logger.warning("Отримано сигнал %s, зупинка", sig.name if sig else "stop")
+        self._stop_task = asyncio.create_task(self._stop_polling(dispatcher))
+
+    @staticmethod
+    async def _stop_polling(dispatcher):
+        # RuntimeError, якщо сигнал прийшов ще до старту опитування:
+        # тоді зупинку повторить on_polling_started
+        with suppress(RuntimeError):
+            await dispatcher.stop_polling()
+
+    async def on_polling_started(self, dispatcher):
+        """dp.startup: сигнал, що прийшов до старту опитування, зупиняє його тепер."""
+        if self.stopping:
+            # Окремою задачею: stop_polling чекає кінця опитування, а воно - кінця startup
+            self._stop_task = asyncio.create_task(self._stop_polling(dispatcher))
+
+    async def drain(self, timeout: float) -> bool:
+        """Чекає завершення оновлень в обробці; False, якщо не встигли за timeout."""
+        if self.in_flight:
+            logger.info("Очікування обробників", extra={"in_flight": self.in_flight})
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.error("Обробники не завершилися вчасно", extra={"in_flight": self.in_flight})
+            return False
+
+    async def hand_over(self, bot):
+        """Після drain: зберігає необроблені оновлення й offset і віддає оренду процесу-заміні."""
+        if self._lease is None:
+            return
+        if self._renew_task is not None:
+            self._renew_task.cancel()
+        unfinished = dict(self._running)
+        tasks = [task for _, task in unfinished.values() if task is not None]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks, timeout=1)
+        if self._lease_lost:
+            # Новий власник уже взяв offset і pending_updates: записане зараз зіпсувало б його стан
+            logger.error("Оренду втрачено, необроблені оновлення не передано",
+                         extra={"update_ids": sorted(unfinished)})
+            self._lease = None
+            return
+        pending = {update_id: event.model_dump_json(by_alias=True, exclude_none=True)
+                   for update_id, (event, _) in unfinished.items()}
+        # Необроблені оновлення попередника, до яких черга так і не дійшла
+        pending.update((update_id, payload) for update_id, payload in self._replay.items()
+                       if update_id not in pending)
+        if pending and await save_pending_updates(pending):
+            logger.warning("Необроблені оновлення передано процесу-заміні",
+                           extra={"count": len(pending), "update_ids": sorted(pending)})
+
+        last = max((value for value in (self.last_update_id, self.offset) if value is not None), default=None)
+        if last is not None:
+            await set_bot_state(UPDATES_OFFSET, last)
+            try:
+                # offset підтверджує всі оновлення до нього; timeout=0 і limit=1 - нічого не чекати
+                # (повернуте оновлення не підтверджується і дістанеться процесу-заміні)
+                await bot.get_updates(offset=last + 1, limit=1, timeout=0)
+            except Exception as e:
+                logger.warning("Не вдалося підтвердити offset: %s", e)
+        await self._release()
+        logger.info("Опитування передано", extra={"update_id": last})
+
+    async def _release(self):
+        """Віддає оренду, лише якщо вона досі наша (compare-and-set за нашим токеном)."""
+        lease = await get_bot_state(POLLING_LEASE)
+        if lease is None or lease.value != self._lease or not await claim_bot_state(POLLING_LEASE, lease, RELEASED):
+            logger.error("Оренда опитування вже не наша, не віддаємо її")
+        self._lease = None
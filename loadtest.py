@@ -0,0 +1,431 @@
+"""Навантажувальний тест бота на локальному симуляторі Bot API.
+
+Імітує студентів, що надсилають запити, і кураторів, які беруть їх у роботу,
+відповідають і завершують діалог. Приклад:
+    python loadtest.py --students 2000 --curators 30 --latency 0.02 --json result.json
+    python loadtest.py --baseline result.json   # ненульовий код виходу при регресії
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from aiogram import BaseMiddleware
+from sqlalchemy import event
+
+from fake_api import FakeBotAPI, BOT_USER
+from keyboards import Action, RequestCallback
+from profiling import handler_name
+
+TOKEN = "123456789:LOADTEST-fake-token"
+CURATOR_CHAT_ID = -1001000000001
+STUDENT_BASE_ID = 1_000_000
+CURATOR_BASE_ID = 9_000_000
+
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE")
+
+
+def percentile(values, pct: float) -> float:
+    """Перцентиль методом найближчого рангу."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+class UpdateTimer(BaseMiddleware):
+    """Зовнішній middleware на dp.update: міряє повну обробку кожного оновлення."""
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = Counter()
+        self._waiters = {}
+
+    def wait_for(self, update_id: int) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[update_id] = future
+        return future
+
+    async def release(self, handler, event, data):
+        """Middleware перед захистом від флуду: знімає очікування доставки і для
+        оновлень, які захист відкинув і які до UpdateTimer не доходять."""
+        try:
+            return await handler(event, data)
+        finally:
+            future = self._waiters.pop(event.update_id, None)
+            if future and not future.done():
+                future.set_result(None)
+
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            self.errors[type(e).__name__] += 1
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+
+
+class HandlerTimer(BaseMiddleware):
+    """Внутрішній middleware: час виконання кожного обробника за його назвою."""
+
+    def __init__(self):
+        self.timings = defaultdict(list)
+
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.timings[handler_name(data)].append(time.perf_counter() - started)
+
+    def report(self) -> dict:
+        return {
+            name: {
+                "count": len(values),
+                "p50_ms": percentile(values, 50) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+                "total_s": sum(values),
+            }
+            for name, values in sorted(self.timings.items(), key=lambda item: -sum(item[1]))
+        }
+
+
+def prepare_env(api_url: str, database_url: str, curator_ids, curator_chat_id: int = CURATOR_CHAT_ID,
+                forums: int = 1, forum_rate: float = 60000):
+    """Змінні середовища мають бути встановлені до імпорту config/main."""
+    os.environ["BOT_TOKEN"] = TOKEN
+    os.environ["TELEGRAM_API_URL"] = api_url
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["CURATOR_CHAT_ID"] = str(curator_chat_id)
+    os.environ["CURATOR_CHAT_IDS"] = ",".join(str(curator_chat_id - i) for i in range(forums)) if forums > 1 else ""
+    os.environ["FORUM_RATE_PER_MINUTE"] = str(forum_rate)
+    os.environ["RECORD_UPDATES"] = ""
+    os.environ["TEACHERS_IDS"] = ",".join(str(i) for i in curator_ids)
+
+
+def user(user_id: int, role: str) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"{role}{user_id}", "username": f"{role}{user_id}"}
+
+
+def message_update(update_id: int, message_id: int, sender: dict, chat_id: int, text: str, thread_id=None) -> dict:
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+        "from": sender,
+        "text": text,
+    }
+    if thread_id:
+        message["message_thread_id"] = thread_id
+        message["is_topic_message"] = True
+    return {"update_id": update_id, "message": message}
+
+
+def action_data(action: Action, request_id: str) -> str:
+    return RequestCallback(action=action, request_id=int(request_id)).pack()
+
+
+def callback_update(update_id: int, sender: dict, message_id: int, data: str, thread_id=None,
+                    chat_id: int = CURATOR_CHAT_ID) -> dict:
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "supergroup"},
+        "from": BOT_USER,
+        "text": "...",
+    }
+    if thread_id:
+        message["message_thread_id"] = thread_id
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": sender,
+            "chat_instance": "loadtest",
+            "message": message,
+            "data": data,
+        },
+    }
+
+
+class LoadTest:
+    def __init__(self, app, engine, api: FakeBotAPI, args):
+        self.app = app
+        self.engine = engine
+        self.api = api
+        self.args = args
+        self.bot = app.get_bot()
+        self.dp = app.dp
+        self.update_timer = UpdateTimer()
+        self.handler_timer = HandlerTimer()
+        self.db_writes = 0
+        self.delivered = 0
+        self.lifecycles = 0
+        self.failed_lifecycles = 0
+        self.curator_locks = [asyncio.Lock() for _ in range(args.curators)]
+
+    def install(self):
+        outer = self.dp.update.outer_middleware
+        outer.unregister(self.app.flood_control)
+        outer(self.update_timer.release)
+        outer(self.app.flood_control)
+        outer(self.update_timer)
+        # Як у main(): виклики у форуми проходять через відра форумів
+        from shards import ShardRateLimiter
+        self.app.get_bot().session.middleware(ShardRateLimiter(self.app.shard_router))
+        self.dp.message.middleware(self.handler_timer)
+        self.dp.callback_query.middleware(self.handler_timer)
+        event.listen(self.engine.sync_engine, "before_cursor_execute", self._count_write)
+
+    def _count_write(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(WRITE_STATEMENTS):
+            self.db_writes += 1
+
+    async def deliver(self, raw: dict):
+        """Доставляє оновлення обраним способом і чекає завершення його обробки."""
+        self.delivered += 1
+        if self.args.mode == "direct":
+            from aiogram.types import Update
+            await self.dp.feed_update(self.bot, Update.model_validate(raw, context={"bot": self.bot}))
+            return
+        done = self.update_timer.wait_for(raw["update_id"])
+        await self.api.push_update(raw)
+        await done
+
+    async def student_lifecycle(self, index: int):
+        api = self.api
+        student = user(STUDENT_BASE_ID + index, "student")
+        await self.deliver(message_update(api.next_update_id(), api.next_message_id(), student, student["id"],
+                                          f"Питання №{index}: як здати лабораторну?"))
+        # Номер запиту видає БД, тож його беремо з кешу бота
+        request_id = self.app.active_requests.get(student["id"])
+        for extra in range(self.args.messages_per_student - 1):
+            await self.deliver(message_update(api.next_update_id(), api.next_message_id(), student, student["id"],
+                                              f"Уточнення {extra} до запиту"))
+
+        if request_id not in self.app.requests:
+            self.failed_lifecycles += 1
+            return
+
+        curator_index = random.randrange(self.args.curators)
+        curator = user(CURATOR_BASE_ID + curator_index, "curator")
+        thread_id = self.app.request_threads.get(request_id)
+        forum_id = self.app.requests[request_id]["chat_id"]
+        # Стан FSM куратора спільний для всього чату, тому один куратор веде запити послідовно
+        async with self.curator_locks[curator_index]:
+            await self.deliver(callback_update(api.next_update_id(), curator, api.next_message_id(),
+                                               action_data(Action.TAKE, request_id), thread_id, forum_id))
+            await self.deliver(callback_update(api.next_update_id(), curator, api.next_message_id(),
+                                               action_data(Action.REPLY, request_id), thread_id, forum_id))
+            await self.deliver(message_update(api.next_update_id(), api.next_message_id(), curator,
+                                              forum_id, "Відповідь куратора", thread_id))
+            await self.deliver(callback_update(api.next_update_id(), curator, api.next_message_id(),
+                                               action_data(Action.FINISH, request_id), thread_id, forum_id))
+
+        if self.app.requests[request_id]["status"] == "Завершено":
+            self.lifecycles += 1
+        else:
+            self.failed_lifecycles += 1
+
+    async def spammer(self, index: int):
+        """Користувач, що надсилає повідомлення без пауз."""
+        api = self.api
+        spammer = user(STUDENT_BASE_ID + self.args.students + index, "spammer")
+        for i in range(self.args.spam_messages):
+            await self.deliver(message_update(api.next_update_id(), api.next_message_id(), spammer, spammer["id"],
+                                              f"спам {i}"))
+
+    async def run(self) -> dict:
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+
+        async def limited(index):
+            async with semaphore:
+                await self.student_lifecycle(index)
+
+        self.api.reset_stats()
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(limited(i) for i in range(self.args.students)),
+            *(self.spammer(i) for i in range(self.args.spammers)),
+        )
+        elapsed = time.perf_counter() - started
+        return self.report(elapsed)
+
+    def report(self, elapsed: float) -> dict:
+        # UpdateTimer стоїть після захисту від флуду, тож бачить лише оброблені оновлення
+        latencies = self.update_timer.latencies
+        updates = len(latencies)
+        api_calls = {method: count for method, count in self.api.calls.items() if method != "getupdates"}
+        total_api = sum(api_calls.values())
+        return {
+            "mode": self.args.mode,
+            "students": self.args.students,
+            "curators": self.args.curators,
+            "delivered": self.delivered,
+            "updates": updates,
+            "elapsed_s": elapsed,
+            "throughput_ups": self.delivered / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "max_ms": max(latencies, default=0.0) * 1000,
+            "db_writes_per_update": self.db_writes / updates if updates else 0.0,
+            "api_calls_per_lifecycle": total_api / self.lifecycles if self.lifecycles else 0.0,
+            "api_calls": api_calls,
+            "rate_limited": dict(self.api.rate_limited),
+            "handler_errors": dict(self.update_timer.errors),
+            "lifecycles": self.lifecycles,
+            "failed_lifecycles": self.failed_lifecycles,
+            "handlers": self.handler_timer.report(),
+            "flood_control": dict(self.app.flood_control.stats),
+            "forums": {str(chat_id): count for chat_id, count in self.app.shard_router.stats.items()},
+        }
+
+
+def print_report(result: dict):
+    print(f"Режим доставки: {result['mode']}, студентів: {result['students']}, кураторів: {result['curators']}")
+    print(f"Оновлень: {result['delivered']} (оброблено {result['updates']}) за {result['elapsed_s']:.2f} с "
+          f"-> {result['throughput_ups']:.1f} оновл./с")
+    print(f"Латентність оновлення: p50 {result['p50_ms']:.2f} мс, p99 {result['p99_ms']:.2f} мс, "
+          f"max {result['max_ms']:.2f} мс")
+    print(f"Записів у БД на оновлення: {result['db_writes_per_update']:.2f}")
+    print(f"Викликів Bot API на життєвий цикл запиту: {result['api_calls_per_lifecycle']:.2f}")
+    print(f"  за методами: {result['api_calls']}")
+    print(f"Завершених циклів: {result['lifecycles']}, невдалих: {result['failed_lifecycles']}")
+    if result["rate_limited"]:
+        print(f"Відповідей 429: {result['rate_limited']}")
+    if result["handler_errors"]:
+        print(f"Помилки обробників: {result['handler_errors']}")
+    if result["flood_control"]:
+        print(f"Захист від флуду: {result['flood_control']}")
+    if len(result["forums"]) > 1:
+        print(f"Запитів за форумами: {result['forums']}")
+    print("Обробники (за сумарним часом):")
+    for name, stats in result["handlers"].items():
+        print(f"  {name:<34} n={stats['count']:<7} p50 {stats['p50_ms']:8.2f} мс  p99 {stats['p99_ms']:8.2f} мс")
+    if "profile" in result:
+        print(result["profile"])
+
+
+def compare_with_baseline(result: dict, baseline: dict, tolerance: float) -> list:
+    """Повертає список регресій відносно збереженого результату."""
+    regressions = []
+    if result["throughput_ups"] < baseline["throughput_ups"] * (1 - tolerance):
+        regressions.append(f"пропускна здатність {result['throughput_ups']:.1f} < {baseline['throughput_ups']:.1f}")
+    for key in ("p50_ms", "p99_ms", "db_writes_per_update", "api_calls_per_lifecycle"):
+        if result[key] > baseline[key] * (1 + tolerance):
+            regressions.append(f"{key} {result[key]:.2f} > {baseline[key]:.2f}")
+    return regressions
+
+
+async def run_load_test(args) -> dict:
+    api = FakeBotAPI(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                     chat_rate_limit=args.chat_rate_limit)
+    await api.start()
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    prepare_env(api.url, f"sqlite+aiosqlite:///{workdir}/loadtest.db",
+                [CURATOR_BASE_ID + i for i in range(args.curators)], forums=args.forums,
+                forum_rate=args.forum_rate)
+
+    import main as app
+    from db import close_db, get_engine
+
+    await app.warm_up()
+
+    test = LoadTest(app, get_engine(), api, args)
+    test.install()
+    if args.profile is not None:
+        app.get_bot().session.middleware(app.profiler.api_timer)
+        app.profiler.enable(get_engine(), slow_ms=args.profile)
+
+    polling = None
+    webhook_runner = None
+    if args.mode == "polling":
+        polling = asyncio.create_task(app.dp.start_polling(
+            app.get_bot(), polling_timeout=1, handle_signals=False, close_bot_session=False))
+    elif args.mode == "webhook":
+        from aiohttp import web
+        from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+        webhook_app = web.Application()
+        SimpleRequestHandler(dispatcher=app.dp, bot=app.get_bot()).register(webhook_app, path="/webhook")
+        webhook_runner = web.AppRunner(webhook_app, access_log=None)
+        await webhook_runner.setup()
+        site = web.TCPSite(webhook_runner, "127.0.0.1", 0)
+        await site.start()
+        port = webhook_runner.addresses[0][1]
+        await app.get_bot().set_webhook(f"http://127.0.0.1:{port}/webhook")
+
+    try:
+        output = open(os.devnull, "w") if args.quiet else sys.stdout
+        with contextlib.redirect_stdout(output):
+            result = await test.run()
+        if args.profile is not None:
+            result["profile"] = app.profiler.report()
+            app.profiler.disable()
+    finally:
+        if polling:
+            await app.dp.stop_polling()
+            await polling
+        if webhook_runner:
+            await webhook_runner.cleanup()
+        await app.get_bot().session.close()
+        await close_db()
+        await api.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Навантажувальний тест бота на симуляторі Bot API")
+    parser.add_argument("--students", type=int, default=1000)
+    parser.add_argument("--curators", type=int, default=20)
+    parser.add_argument("--forums", type=int, default=1, help="кількість форумів кураторів (див. shards.py)")
+    parser.add_argument("--concurrency", type=int, default=200, help="одночасно активних студентів")
+    parser.add_argument("--messages-per-student", type=int, default=2)
+    parser.add_argument("--spammers", type=int, default=0, help="користувачів, що флудять")
+    parser.add_argument("--spam-messages", type=int, default=50, help="повідомлень від кожного")
+    parser.add_argument("--mode", choices=("direct", "polling", "webhook"), default="direct")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--chat-rate-limit", type=int, default=0)
+    parser.add_argument("--forum-rate", type=float, default=60000,
+                        help="FORUM_RATE_PER_MINUTE бота (за замовчуванням практично без обмеження)")
+    parser.add_argument("--profile", type=float, metavar="MS",
+                        help="увімкнути профілювання (profiling.py) з порогом повільного обробника")
+    parser.add_argument("--json", help="зберегти результат у файл")
+    parser.add_argument("--baseline", help="порівняти з раніше збереженим результатом")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустиме погіршення (частка)")
+    parser.add_argument("--verbose", dest="quiet", action="store_false", help="не приховувати вивід бота")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    result = asyncio.run(run_load_test(args))
+    print_report(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_with_baseline(result, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"РЕГРЕСІЯ: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
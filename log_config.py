@@ -0,0 +1,139 @@
+"""Структуроване логування бота.
+
+Записи форматуються в JSON і передаються через чергу окремому потоку
+(QueueHandler/QueueListener), тож запис у stdout чи файл не блокує цикл подій.
+До кожного запису додаються update_id, request_id і correlation_id поточного
+оновлення. Налаштування через змінні середовища:
+    LOG_LEVEL        - рівень логування (INFO за замовчуванням)
+    LOG_FILE         - додатково писати у файл
+    LOG_SQL          - рівень для SQL-запитів SQLAlchemy (WARNING за замовчуванням)
+    LOG_SAMPLE_RATE  - частка записів гарячих шляхів (extra={"hot": True}), що потрапляють у лог
+"""
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+
+from aiogram import BaseMiddleware
+
+update_id_var = contextvars.ContextVar("update_id", default=None)
+request_id_var = contextvars.ContextVar("request_id", default=None)
+correlation_id_var = contextvars.ContextVar("correlation_id", default=None)
+
+# Стандартні атрибути LogRecord, які не треба дублювати в JSON як extra-поля
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "hot"}
+
+NOISY_LOGGERS = ("aiosqlite", "asyncio", "aiogram.event")
+
+_listener = None
+
+
+def bind_request(request_id):
+    """Прив'язує request_id до всіх наступних записів у межах поточного оновлення."""
+    request_id_var.set(str(request_id) if request_id is not None else None)
+
+
+class ContextFilter(logging.Filter):
+    """Додає кореляційні ідентифікатори з contextvars (виконується в потоці виклику)."""
+
+    def filter(self, record):
+        if getattr(record, "update_id", None) is None:
+            record.update_id = update_id_var.get()
+        if getattr(record, "request_id", None) is None:
+            record.request_id = request_id_var.get()
+        if getattr(record, "correlation_id", None) is None:
+            record.correlation_id = correlation_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускає лише частку записів гарячих шляхів; попередження й помилки не відкидаються."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not getattr(record, "hot", False):
+            return True
+        return self.rate >= 1.0 or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LoggingContextMiddleware(BaseMiddleware):
+    """Зовнішній middleware на dp.update: задає кореляційні id для обробки оновлення."""
+
+    async def __call__(self, handler, event, data):
+        tokens = (
+            update_id_var.set(event.update_id),
+            request_id_var.set(None),
+            correlation_id_var.set(uuid.uuid4().hex[:12]),
+        )
+        try:
+            return await handler(event, data)
+        finally:
+            correlation_id_var.reset(tokens[2])
+            request_id_var.reset(tokens[1])
+            update_id_var.reset(tokens[0])
+
+
+def setup_logging():
+    """Налаштовує кореневий логер. Повторний виклик нічого не робить."""
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    formatter = JsonFormatter()
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    # Форматуємо в потоці виклику, щоб у чергу потрапив уже готовий рядок з контекстом
+    queue_handler.setFormatter(formatter)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(SamplingFilter(float(os.getenv("LOG_SAMPLE_RATE", "0.1"))))
+
+    passthrough = logging.Formatter("%(message)s")
+    outputs = [logging.StreamHandler(sys.stdout)]
+    if os.getenv("LOG_FILE"):
+        outputs.append(logging.FileHandler(os.getenv("LOG_FILE"), encoding="utf-8"))
+    for output in outputs:
+        output.setFormatter(passthrough)
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    logging.getLogger("sqlalchemy.engine").setLevel(os.getenv("LOG_SQL", "WARNING").upper())
+    # Службові логери бібліотек пишуть рядок на кожну операцію/оновлення
+    for name in NOISY_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, *outputs, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging():
+    """Дописує чергу і зупиняє потік запису."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
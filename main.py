@@ -1,26 +1,143 @@
-from datetime import datetime
+from startup import Startup  # першим: відлік часу старту ведеться від імпорту startup
+
+from datetime import datetime, timedelta, timezone
 import asyncio
+import logging
 
 from aiogram import F
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, BufferedInputFile
 from aiogram.fsm.context import FSMContext
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from zoneinfo import ZoneInfo
 
-from config import TOKEN, TEACHERS_IDS, ADMIN_ID, CURATOR_CHAT_ID, ReplyState, TeacherState, bot, dp
+from config import (
+    TOKEN, TEACHERS_IDS, ADMIN_ID, CURATOR_CHAT_ID, CURATOR_CHAT_IDS, RECORD_UPDATES,
+    FORUM_RATE_PER_MINUTE, FORUM_BURST, DIGEST_DAILY_AT, DIGEST_WEEKLY_AT, SLA_MINUTES, STALE_HOLD_HOURS,
+    PROFILE_ENABLED, PROFILE_SLOW_MS, PROFILE_MODE, SHUTDOWN_TIMEOUT,
+    FLOOD_RATE, FLOOD_BURST, MAX_IN_FLIGHT, FLOOD_DEFER_TIMEOUT, FLOOD_NOTICE_WINDOW,
+    ReplyState, TeacherState, get_bot, dp, storage
+)
 from db import (
-    log_curator_action, log_message, init_db,
+    ACTION_TAKE, ACTION_FINISH, ACTION_HOLD, ACTION_REASSIGN, log_curator_action, log_message, init_db, close_db,
     get_all_teachers, add_teacher, deactivate_teacher,
-    is_teacher, get_teacher_by_id
+    is_teacher, get_teacher_by_id, create_broadcast_job, get_broadcast_jobs,
+    create_request, save_request, get_open_requests, close_topicless_requests, get_snippets, add_snippet, deactivate_snippet, get_engine
 )
+import broadcast
+from throttling import FloodControlMiddleware
+from shards import ShardRateLimiter, ShardRouter, parse_shards, priority_lane
+from snippets import SnippetIndex
+from history import PageCache, render_page
+from scheduler import Scheduler
+from digest import build_digest, send_digest
+from profiling import MODES as PROFILE_MODES, Profiler
+from lifecycle import Lifecycle
+from keyboards import (
+    Action, RequestCallback, SnippetCallback, HistoryCallback,
+    request_keyboard, with_snippets, with_history, history_keyboard,
+    STATUS_NEW, STATUS_IN_WORK, STATUS_ON_HOLD, STATUS_DONE
+)
+from recorder import UpdateRecorder
+from log_config import LoggingContextMiddleware, bind_request, setup_logging, shutdown_logging
 
-if not TOKEN or not TEACHERS_IDS or not CURATOR_CHAT_ID:
-    raise ValueError("BOT_TOKEN, TEACHERS_IDS або CURATOR_CHAT_ID не знайдено в .env файлі")
+logger = logging.getLogger("bot")
 
 # Зберігаємо запити
 requests = {}
 # Track thread IDs for each request
 request_threads = {}
+# Незавершений запит кожного студента: student_id -> request_id
+active_requests = {}
+# Куратори з .env; решта ростеру - активні куратори з БД (див. load_roster)
+CONFIG_TEACHERS_IDS = tuple(TEACHERS_IDS)
+# Шаблонні відповіді, що пропонуються кураторам до нового запиту
+snippet_index = SnippetIndex()
+SNIPPET_SUGGESTIONS = 3
+# Сторінки історії студентів (див. history.py)
+history_pages = PageCache()
+
+dp.update.outer_middleware(LoggingContextMiddleware())
+
+# Оновлення в обробці й offset для плавної зупинки (див. lifecycle.py)
+lifecycle = Lifecycle()
+dp.update.outer_middleware(lifecycle)
+
+startup = Startup()
+dp.update.outer_middleware(startup)
+dp.startup.register(startup.on_polling_started)
+dp.startup.register(lifecycle.on_polling_started)
+dp.update.outer_middleware(lifecycle.skip_replayed)
+
+# Форуми кураторів, між якими розподіляються теми запитів
+shard_router = ShardRouter(
+    parse_shards(CURATOR_CHAT_IDS, CURATOR_CHAT_ID),
+    rate=FORUM_RATE_PER_MINUTE / 60,
+    burst=FORUM_BURST,
+)
+
+recorder = None
+if RECORD_UPDATES:
+    recorder = UpdateRecorder(RECORD_UPDATES, teacher_ids=TEACHERS_IDS,
+                              curator_chat_id=shard_router.default_chat_id)
+    dp.update.outer_middleware(recorder)
+
+flood_control = FloodControlMiddleware(
+    rate=FLOOD_RATE,
+    burst=FLOOD_BURST,
+    max_in_flight=MAX_IN_FLIGHT,
+    defer_timeout=FLOOD_DEFER_TIMEOUT,
+    notice_window=FLOOD_NOTICE_WINDOW,
+    is_priority=lambda user_id: user_id in TEACHERS_IDS or user_id == ADMIN_ID,
+)
+dp.update.outer_middleware(flood_control)
+
+# Профілювання обробників (див. profiling.py), вимкнене поки не ввімкнуть /profile on
+profiler = Profiler(slow_ms=PROFILE_SLOW_MS, mode=PROFILE_MODE)
+dp.message.middleware(profiler)
+dp.callback_query.middleware(profiler)
+
+
+async def curator_priority(handler, event, data):
+    """Виклики Bot API під час дій кураторів ідуть пріоритетною чергою форуму (див. shards.py)."""
+    if event.from_user is None or event.from_user.id not in TEACHERS_IDS:
+        return await handler(event, data)
+    token = priority_lane.set(True)
+    try:
+        return await handler(event, data)
+    finally:
+        priority_lane.reset(token)
+
+
+dp.message.middleware(curator_priority)
+dp.callback_query.middleware(curator_priority)
+
+
+async def persist_request(request_id: str, **fields):
+    """Зберігає поточний стан запиту в БД, щоб відкриті запити пережили перезапуск."""
+    data = requests[request_id]
+    await save_request(
+        request_id,
+        student_id=data["student_id"],
+        student_name=data.get("student_name"),
+        student_username=data.get("student_username"),
+        chat_id=data["chat_id"],
+        thread_id=request_threads.get(request_id),
+        status=data["status"],
+        curator_id=data.get("curator_id"),
+        curator_username=data.get("curator_username"),
+        curator_name=data.get("curator_name"),
+        **fields
+    )
+
+
+def request_markup(request_id: str):
+    """Клавіатура запиту за його статусом разом із підказаними шаблонами й кнопкою історії."""
+    data = requests[request_id]
+    keyboard = request_keyboard(data["status"], int(request_id))
+    if keyboard is None:
+        return None
+    keyboard = with_snippets(keyboard, int(request_id), data.get("suggestions", ()))
+    return with_history(keyboard, int(request_id))
 
 
 @dp.message(Command("start"))
@@ -67,7 +184,7 @@ async def add_teacher_request(callback_query: CallbackQuery, state: FSMContext):
 
     await callback_query.answer()
     await state.set_state(TeacherState.waiting_for_new_teacher)
-    await bot.send_message(
+    await get_bot().send_message(
         callback_query.from_user.id,
         "Надішліть ID нового вчителя в форматі:\n1234567890, Ім'я Прізвище"
     )
@@ -82,12 +199,200 @@ async def remove_teacher_request(callback_query: CallbackQuery, state: FSMContex
 
     await callback_query.answer()
     await state.set_state(TeacherState.waiting_for_teacher_removal)
-    await bot.send_message(
+    await get_bot().send_message(
         callback_query.from_user.id,
         "Надішліть ID вчителя, якого потрібно видалити:"
     )
 
 
+BROADCAST_AUDIENCES = {"all": "всі, хто писав боту", "students": "студенти", "active": "активні студенти"}
+
+
+@dp.message(Command("broadcast"))
+async def start_broadcast(message: Message, command: CommandObject):
+    """Запустити розсилку (только для админа): /broadcast [all|students|active] текст"""
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("У вас немає прав для виконання цієї команди.")
+        return
+
+    text = (command.args or "").strip()
+    audience = "all"
+    first_word = text.split(maxsplit=1)[0] if text else ""
+    if first_word in BROADCAST_AUDIENCES:
+        audience = first_word
+        text = text[len(first_word):].strip()
+
+    if not text:
+        await message.answer(
+            "Використання: /broadcast [all|students|active] текст оголошення\n"
+            "all - всі, хто писав боту; students - лише студенти; active - студенти за останній місяць."
+        )
+        return
+
+    job = await create_broadcast_job(text, audience, message.from_user.id)
+    if job is None:
+        await message.answer("❌ Помилка при створенні розсилки.")
+        return
+
+    broadcast.start_job(get_bot(), job.id)
+    await message.answer(
+        f"📢 Розсилку #{job.id} запущено ({BROADCAST_AUDIENCES[audience]}): {job.total} отримувачів.\n"
+        f"Орієнтовний час: {int(job.total / broadcast.bucket.rate) + 1} с."
+    )
+
+
+@dp.message(Command("broadcast_status"))
+async def broadcast_status(message: Message):
+    """Стан останніх розсилок (только для админа)"""
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("У вас немає прав для виконання цієї команди.")
+        return
+
+    jobs = (await get_broadcast_jobs())[:5]
+    if not jobs:
+        await message.answer("Розсилок ще не було.")
+        return
+
+    text = "📢 Останні розсилки:\n\n"
+    for job in jobs:
+        processed = job.delivered + job.failed
+        text += (f"#{job.id} [{job.status}] {processed}/{job.total}: "
+                 f"доставлено {job.delivered}, не доставлено {job.failed} (заблокували {job.blocked})\n")
+    await message.answer(text)
+
+
+@dp.message(Command("broadcast_cancel"))
+async def cancel_broadcast(message: Message, command: CommandObject):
+    """Зупинити розсилку (только для админа): /broadcast_cancel ID"""
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("У вас немає прав для виконання цієї команди.")
+        return
+
+    try:
+        job_id = int((command.args or "").strip())
+    except ValueError:
+        await message.answer("Використання: /broadcast_cancel ID")
+        return
+
+    if await broadcast.cancel_job(job_id):
+        await message.answer(f"⏹ Розсилку #{job_id} зупинено.")
+    else:
+        await message.answer(f"Розсилку #{job_id} не знайдено або вона вже завершена.")
+
+
+@dp.message(Command("snippets"))
+async def list_snippets(message: Message):
+    """Список шаблонних відповідей (только для админа)"""
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("У вас немає прав для виконання цієї команди.")
+        return
+
+    if not snippet_index.snippets:
+        await message.answer(
+            "Шаблонів ще немає.\n"
+            "Додати: /snippet_add Заголовок | текст відповіді\n"
+            "Видалити: /snippet_remove ID"
+        )
+        return
+
+    text = "💡 Шаблонні відповіді:\n\n"
+    for snippet_id, (title, body) in snippet_index.snippets.items():
+        preview = body if len(body) <= 80 else body[:77] + "..."
+        text += f"#{snippet_id} {title}: {preview}\n"
+    await message.answer(text)
+
+
+@dp.message(Command("snippet_add"))
+async def create_snippet(message: Message, command: CommandObject):
+    """Додати шаблонну відповідь (только для админа): /snippet_add Заголовок | текст"""
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("У вас немає прав для виконання цієї команди.")
+        return
+
+    title, _, body = (command.args or "").partition("|")
+    title, body = title.strip(), body.strip()
+    if not title or not body:
+        await message.answer("Використання: /snippet_add Заголовок | текст відповіді")
+        return
+    if len(title) > 60:
+        await message.answer("Заголовок задовгий для кнопки (максимум 60 символів).")
+        return
+
+    snippet = await add_snippet(title, body, message.from_user.id)
+    if snippet is None:
+        await message.answer("❌ Помилка при додаванні шаблону.")
+        return
+
+    snippet_index.build(await get_snippets())
+    await message.answer(f"✅ Шаблон #{snippet.id} «{title}» додано.")
+
+
+@dp.message(Command("snippet_remove"))
+async def remove_snippet(message: Message, command: CommandObject):
+    """Видалити шаблонну відповідь (только для админа): /snippet_remove ID"""
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("У вас немає прав для виконання цієї команди.")
+        return
+
+    try:
+        snippet_id = int((command.args or "").strip().lstrip("#"))
+    except ValueError:
+        await message.answer("Використання: /snippet_remove ID")
+        return
+
+    if await deactivate_snippet(snippet_id):
+        snippet_index.build(await get_snippets())
+        await message.answer(f"✅ Шаблон #{snippet_id} видалено.")
+    else:
+        await message.answer(f"Шаблон #{snippet_id} не знайдено.")
+
+
+@dp.message(Command("digest"))
+async def digest_now(message: Message):
+    """Звіт за останню добу на вимогу (только для админа)"""
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("У вас немає прав для виконання цієї команди.")
+        return
+
+    until = datetime.utcnow()
+    await message.answer(await build_digest("Звіт за добу", until - timedelta(days=1), until,
+                                            SLA_MINUTES, STALE_HOLD_HOURS))
+
+
+@dp.message(Command("profile"))
+async def profile_command(message: Message, command: CommandObject):
+    """Профілювання (только для админа): /profile on [stack|cprofile] [поріг, мс] | off | dump | reset"""
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("У вас немає прав для виконання цієї команди.")
+        return
+
+    args = (command.args or "dump").split()
+    action = args[0].lower()
+    if action == "on":
+        mode = next((arg for arg in args[1:] if arg in PROFILE_MODES), None)
+        slow_ms = next((float(arg) for arg in args[1:] if arg.isdigit()), None)
+        profiler.enable(get_engine(), slow_ms=slow_ms, mode=mode)
+        await message.answer(f"🔬 Профілювання ввімкнено: режим {profiler.mode}, "
+                             f"поріг {profiler.slow_seconds * 1000:.0f} мс. Звіт: /profile dump")
+        return
+    if action == "reset":
+        profiler.reset()
+        await message.answer("🔬 Статистику профілювання очищено.")
+        return
+    if action not in ("off", "dump"):
+        await message.answer("Використання: /profile on [stack|cprofile] [поріг, мс] | off | dump | reset")
+        return
+
+    if action == "off":
+        profiler.disable()
+    report = profiler.report()
+    # Стеки повільних обробників легко перевищують ліміт повідомлення, тоді звіт іде файлом
+    if len(report) > 4000:
+        await message.answer_document(BufferedInputFile(report.encode(), filename="profile.txt"))
+    else:
+        await message.answer(report)
+
+
 @dp.message(TeacherState.waiting_for_new_teacher)
 async def process_add_teacher(message: Message, state: FSMContext):
     """Обработать добавление нового учителя"""
@@ -164,73 +469,79 @@ async def process_remove_teacher(message: Message, state: FSMContext):
 async def process_reply(message: Message, state: FSMContext):
     """Куратор відповідає, бот пересилає відповідь студенту."""
 
-    print(f"✅ Обробник відповіді спрацював! Отримано відповідь від куратора: '{message.text}'")
+    logger.debug("Отримано відповідь куратора",
+                 extra={"user_id": message.from_user.id, "text_len": len(message.text or "")})
 
     if message.from_user.id not in TEACHERS_IDS:
-        print("❌ Не куратор пише повідомлення в режимі відповіді! Ігноруємо.")
+        logger.warning("Не куратор пише повідомлення в режимі відповіді, ігноруємо",
+                       extra={"user_id": message.from_user.id})
         return
 
     data = await state.get_data()
-    print(f"📝 Дані стану: {data}")
 
     request_id = data.get("request_id")
+    bind_request(request_id)
     if not request_id or request_id not in requests:
         await message.answer("⚠ Помилка: Запит не знайдено.")
         await state.clear()
         return
 
-    curator_id = message.from_user.id
-    await log_message(request_id, curator_id, "curator", message.text)
+    try:
+        await send_curator_reply(request_id, message.from_user, message.text, message.date)
+    except Exception as e:
+        logger.exception("Помилка при надсиланні відповіді студенту",
+                         extra={"student_id": requests[request_id]["student_id"]})
+        await message.answer(f"⚠ Помилка при надсиланні відповіді: {e}")
 
-    student_id = requests[request_id]["student_id"]
-    print(f"📊 Надсилаємо відповідь студенту з ID: {student_id}")
+    await state.clear()
 
-    try:
-        await bot.send_message(
-            chat_id=student_id,
-            text=f"📩 Відповідь від куратора:\n\n{message.text}"
-        )
-        print(f"✅ Відповідь успішно надіслано студенту {student_id}")
 
-        if requests[request_id]["status"] != "У роботі":
-            requests[request_id]["status"] = "У роботі"
-            requests[request_id]["curator_id"] = message.from_user.id
+async def send_curator_reply(request_id: str, curator, text: str, sent_at: datetime, label: str = "відповів"):
+    """Надсилає відповідь куратора студенту, оновлює стан запиту і дублює відповідь у тред."""
+    student_id = requests[request_id]["student_id"]
+    await log_message(request_id, curator.id, "curator", text, student_id=student_id)
 
-        if "messages" not in requests[request_id]:
-            requests[request_id]["messages"] = []
+    await get_bot().send_message(
+        chat_id=student_id,
+        text=f"📩 Відповідь від куратора:\n\n{text}"
+    )
+    logger.info("Відповідь надіслано студенту", extra={"student_id": student_id})
 
-        requests[request_id]["messages"].append({
-            "from": "curator",
-            "text": message.text,
-            "time": message.date.isoformat()
-        })
+    if requests[request_id]["status"] != STATUS_IN_WORK:
+        requests[request_id]["status"] = STATUS_IN_WORK
+        requests[request_id]["curator_id"] = curator.id
+        await persist_request(request_id)
 
-        # Додаємо відповідь у тред
-        thread_id = request_threads.get(request_id)
-        if thread_id:
-            await bot.send_message(
-                chat_id=CURATOR_CHAT_ID,
-                message_thread_id=thread_id,
-                text=f"💬 Куратор @{message.from_user.username or message.from_user.full_name} відповів:\n\n{message.text}"
-            )
+    if "messages" not in requests[request_id]:
+        requests[request_id]["messages"] = []
 
-    except Exception as e:
-        print(f"❌ Помилка при надсиланні відповіді студенту: {e}")
-        await message.answer(f"⚠ Помилка при надсиланні відповіді: {e}")
+    requests[request_id]["messages"].append({
+        "from": "curator",
+        "text": text,
+        "time": sent_at.isoformat()
+    })
 
-    await state.clear()
+    # Додаємо відповідь у тред
+    thread_id = request_threads.get(request_id)
+    forum_id = requests[request_id]["chat_id"]
+    if thread_id:
+        await get_bot().send_message(
+            chat_id=forum_id,
+            message_thread_id=thread_id,
+            text=f"💬 Куратор @{curator.username or curator.full_name} {label}:\n\n{text}"
+        )
 
 
 @dp.message()
 async def handle_student_request(message: Message, state: FSMContext):
     """Обробляємо повідомлення від студента та створюємо тред у чаті кураторів."""
-    print(f"⚠️ Загальний обробник повідомлень. ID: {message.from_user.id}, Текст: '{message.text}'")
+    logger.info("Загальний обробник повідомлень",
+                extra={"user_id": message.from_user.id, "text_len": len(message.text or ""), "hot": True})
 
     current_state = await state.get_state()
-    print(f"⚠️ Поточний стан: {current_state}")
 
     if current_state is not None:
-        print("⚠️ Є активний стан, пропускаємо загальний обробник")
+        logger.debug("Є активний стан, пропускаємо загальний обробник", extra={"fsm_state": current_state})
         return
 
     student_id = message.from_user.id
@@ -242,13 +553,10 @@ async def handle_student_request(message: Message, state: FSMContext):
     student_name = message.from_user.full_name
     student_username = message.from_user.username
 
-    active_request_id = None
-    for req_id, req_data in requests.items():
-        if req_data["student_id"] == student_id and req_data["status"] != "Завершено":
-            active_request_id = req_id
-            break
+    active_request_id = active_requests.get(student_id)
 
     if active_request_id:
+        bind_request(active_request_id)
         # Додаємо повідомлення до активного запиту
         if "messages" not in requests[active_request_id]:
             requests[active_request_id]["messages"] = []
@@ -263,12 +571,13 @@ async def handle_student_request(message: Message, state: FSMContext):
 
         # Додаємо повідомлення студента у відповідний тред
         thread_id = request_threads.get(active_request_id)
+        forum_id = requests[active_request_id]["chat_id"]
         if thread_id:
             # Пошук і видалення клавіатури з останнього повідомлення куратора у треді
             try:
                 # Спробуємо отримати всі повідомлення в треді
-                messages = await bot.get_chat_history(
-                    chat_id=CURATOR_CHAT_ID,
+                messages = await get_bot().get_chat_history(
+                    chat_id=forum_id,
                     message_thread_id=thread_id,
                     limit=20  # Обмежуємо пошук останніми 20 повідомленнями
                 )
@@ -277,47 +586,21 @@ async def handle_student_request(message: Message, state: FSMContext):
                 for msg in messages:
                     if msg.reply_markup is not None:
                         # Знайдено повідомлення з кнопками, видаляємо їх
-                        await bot.edit_message_reply_markup(
-                            chat_id=CURATOR_CHAT_ID,
+                        await get_bot().edit_message_reply_markup(
+                            chat_id=forum_id,
                             message_id=msg.message_id,
                             reply_markup=None
                         )
                         break
             except Exception as e:
-                print(f"❌ Помилка при спробі видалити клавіатуру з попереднього повідомлення: {e}")
-
-            # Створюємо клавіатуру в залежності від статусу запиту
-            keyboard = None
-            if requests[active_request_id]["status"] == "Очікує обробки":
-                keyboard = InlineKeyboardMarkup(
-                    inline_keyboard=[
-                        [
-                            InlineKeyboardButton(text="Взяти в роботу", callback_data=f"take_{active_request_id}")
-                        ]
-                    ]
-                )
-            elif requests[active_request_id]["status"] == "У роботі":
-                curator_id = requests[active_request_id].get("curator_id")
-                if curator_id:
-                    keyboard = InlineKeyboardMarkup(
-                        inline_keyboard=[
-                            [
-                                InlineKeyboardButton(text="Відповісти", callback_data=f"reply_{active_request_id}"),
-                                InlineKeyboardButton(text="Завершити діалог",
-                                                     callback_data=f"finish_{active_request_id}")
-                            ],
-                            [
-                                InlineKeyboardButton(text="Поставити на утримання",
-                                                     callback_data=f"hold_{active_request_id}"),
-                                InlineKeyboardButton(text="Переназначити",
-                                                     callback_data=f"reassign_{active_request_id}")
-                            ]
-                        ]
-                    )
+                logger.debug("Не вдалося видалити клавіатуру з попереднього повідомлення: %s", e)
+
+            # Клавіатура в залежності від статусу запиту
+            keyboard = request_markup(active_request_id)
 
             # Надсилаємо нове повідомлення з актуальними кнопками
-            await bot.send_message(
-                chat_id=CURATOR_CHAT_ID,
+            await get_bot().send_message(
+                chat_id=forum_id,
                 message_thread_id=thread_id,
                 text=f"📨 Нове повідомлення від студента:\n\n{message.text}",
                 reply_markup=keyboard
@@ -328,7 +611,18 @@ async def handle_student_request(message: Message, state: FSMContext):
 
     # Код для створення нового запиту залишається без змін...
     # Создаем новый запит
-    request_id = str(message.message_id)
+    forum_id = shard_router.route(student_id, message.text)
+    # Номер запиту видає БД: message_id збігається в різних студентів
+    request_id = await create_request(
+        student_id=student_id, student_name=student_name, student_username=student_username,
+        chat_id=forum_id, status=STATUS_NEW, created_at=message.date.replace(tzinfo=None)
+    )
+    if request_id is None:
+        await message.answer("⚠️ Не вдалося створити запит. Спробуйте, будь ласка, ще раз трохи пізніше.")
+        return
+    bind_request(request_id)
+    if recorder:
+        recorder.note_request(request_id, student_id)
 
     await log_message(request_id, student_id, "student", message.text)
 
@@ -337,32 +631,37 @@ async def handle_student_request(message: Message, state: FSMContext):
         "student_name": student_name,
         "student_username": student_username,
         "text": message.text,
-        "status": "Очікує обробки",
+        "status": STATUS_NEW,
+        "chat_id": forum_id,
         "messages": [{"from": "student", "text": message.text, "time": message.date.isoformat()}]
     }
+    active_requests[student_id] = request_id
 
     # Створюємо тред у чаті кураторів
     student_info = f"@{student_username}" if student_username else student_name
 
     # Створюємо окремий тред без отправки сообщения в общий чат
-    thread_message = await bot.create_forum_topic(
-        chat_id=CURATOR_CHAT_ID,
+    thread_message = await get_bot().create_forum_topic(
+        chat_id=forum_id,
         name=f"Запит: {student_info} - {datetime.now(ZoneInfo('Europe/Kiev')).strftime('%d.%m %H:%M')}",
         icon_color=0x6FB9F0
     )
 
     thread_id = thread_message.message_thread_id
     request_threads[request_id] = thread_id
+    await persist_request(request_id)
 
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Взяти в роботу", callback_data=f"take_{request_id}")]
-        ]
-    )
+    # Найближчі до тексту запиту шаблонні відповіді зберігаються із запитом:
+    # request_markup додає їх (і кнопку історії) до кожної наступної клавіатури
+    requests[request_id]["suggestions"] = [
+        (snippet_id, snippet_index.snippets[snippet_id][0])
+        for snippet_id, _ in snippet_index.search(message.text, SNIPPET_SUGGESTIONS)
+    ]
+    keyboard = request_markup(request_id)
 
     # Відправляємо детальне повідомлення у створений тред
-    await bot.send_message(
-        chat_id=CURATOR_CHAT_ID,
+    await get_bot().send_message(
+        chat_id=forum_id,
         message_thread_id=thread_id,
         text=f"📩 **Новий запит від {student_name}**\n\n"
              f"📝 *{message.text}*\n"
@@ -375,8 +674,7 @@ async def handle_student_request(message: Message, state: FSMContext):
     await message.answer("✅ Ваш запит надіслано кураторам. Очікуйте відповідь.")
 
 
-@dp.callback_query(F.data.startswith("reply_"))
-async def ask_for_reply(callback_query: CallbackQuery, state: FSMContext):
+async def ask_for_reply(callback_query: CallbackQuery, request_id: str, state: FSMContext):
     """Куратор натискає 'Відповісти'."""
     curator_id = callback_query.from_user.id
 
@@ -384,9 +682,7 @@ async def ask_for_reply(callback_query: CallbackQuery, state: FSMContext):
         await callback_query.answer("У вас немає прав для виконання цієї дії.")
         return
 
-    request_id = callback_query.data.split("_")[1]
-
-    print(f"🔍 Натиснуто кнопку 'Відповісти'. request_id={request_id}, curator_id={curator_id}")
+    logger.info("Натиснуто кнопку 'Відповісти'", extra={"curator_id": curator_id})
 
     if request_id not in requests:
         await callback_query.answer("Запит не знайдено")
@@ -399,25 +695,23 @@ async def ask_for_reply(callback_query: CallbackQuery, state: FSMContext):
         return
 
     await state.update_data(request_id=request_id)
-    print(f"💾 Збережено в стані: request_id={request_id}")
 
     await callback_query.answer()
 
     await state.set_state(ReplyState.waiting_for_reply)
-    print("🔄 Встановлено стан: waiting_for_reply")
 
     # Також відправляємо повідомлення в тред
     thread_id = request_threads.get(request_id)
+    forum_id = requests[request_id]["chat_id"]
     if thread_id:
-        await bot.send_message(
-            chat_id=CURATOR_CHAT_ID,
+        await get_bot().send_message(
+            chat_id=forum_id,
             message_thread_id=thread_id,
             text=f"⌨️ Куратор @{callback_query.from_user.username or callback_query.from_user.full_name} готує відповідь..."
         )
 
 
-@dp.callback_query(F.data.startswith("take_"))
-async def take_request(callback_query: CallbackQuery, state: FSMContext):
+async def take_request(callback_query: CallbackQuery, request_id: str, state: FSMContext):
     """Куратор бере запит у роботу"""
     curator_id = callback_query.from_user.id
 
@@ -425,14 +719,12 @@ async def take_request(callback_query: CallbackQuery, state: FSMContext):
         await callback_query.answer("У вас немає прав для виконання цієї дії.")
         return
 
-    request_id = callback_query.data.split("_")[1]
-
     if request_id not in requests:
         await callback_query.answer("Запит не знайдено")
         return
 
     # Перевіряємо, чи запит вже взятий в роботу іншим куратором
-    if requests[request_id]["status"] == "У роботі" and requests[request_id].get("curator_id") != curator_id:
+    if requests[request_id]["status"] == STATUS_IN_WORK and requests[request_id].get("curator_id") != curator_id:
         await callback_query.answer("Цей запит вже взятий в роботу іншим куратором")
         return
 
@@ -442,9 +734,9 @@ async def take_request(callback_query: CallbackQuery, state: FSMContext):
     reaction_time = take_time - request_time
 
     reaction_seconds = int(reaction_time.total_seconds())
-    print(f"Секунди реакції: {reaction_seconds}")
+    logger.info("Запит взято в роботу", extra={"curator_id": curator_id, "reaction_seconds": reaction_seconds})
 
-    await log_curator_action(request_id, curator_id, "взяв у роботу")
+    await log_curator_action(request_id, curator_id, ACTION_TAKE)
 
     if reaction_seconds < 60:
         reaction_str = "1 хвилина"
@@ -459,26 +751,16 @@ async def take_request(callback_query: CallbackQuery, state: FSMContext):
 
     requests[request_id]["reaction_time"] = reaction_str
 
-    requests[request_id]["status"] = "У роботі"
+    requests[request_id]["status"] = STATUS_IN_WORK
     requests[request_id]["curator_id"] = curator_id
 
     requests[request_id]["curator_username"] = callback_query.from_user.username
     requests[request_id]["curator_name"] = callback_query.from_user.full_name
+    await persist_request(request_id)
 
     await callback_query.answer("Ви взяли запит у роботу")
 
-    curator_keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(text="Відповісти", callback_data=f"reply_{request_id}"),
-                InlineKeyboardButton(text="Завершити діалог", callback_data=f"finish_{request_id}")
-            ],
-            [
-                InlineKeyboardButton(text="Поставити на утримання", callback_data=f"hold_{request_id}"),
-                InlineKeyboardButton(text="Переназначити", callback_data=f"reassign_{request_id}")
-            ]
-        ]
-    )
+    curator_keyboard = request_markup(request_id)
 
     curator_username = callback_query.from_user.username
     curator_name = callback_query.from_user.full_name
@@ -487,19 +769,21 @@ async def take_request(callback_query: CallbackQuery, state: FSMContext):
 
     # Використовуємо callback_query.message для видалення кнопок з поточного повідомлення
     try:
-        await bot.edit_message_reply_markup(
+        await get_bot().edit_message_reply_markup(
             chat_id=callback_query.message.chat.id,
             message_id=callback_query.message.message_id,
             reply_markup=None
         )
     except Exception as e:
-        print(f"Помилка при видаленні кнопок: {e}")
+        logger.warning("Помилка при видаленні кнопок: %s", e)
 
     thread_id = request_threads.get(request_id)
+
+    forum_id = requests[request_id]["chat_id"]
     if thread_id:
         # Оновлюємо повідомлення в треді
-        await bot.send_message(
-            chat_id=CURATOR_CHAT_ID,
+        await get_bot().send_message(
+            chat_id=forum_id,
             message_thread_id=thread_id,
             text=f"🚀 Запит взято в роботу куратором {curator_info}.\n"
                  f"⏱ Час взяття в роботу: {take_time.strftime('%Y-%m-%d %H:%M:%S')}\n"
@@ -511,23 +795,21 @@ async def take_request(callback_query: CallbackQuery, state: FSMContext):
         student_info = requests[request_id].get("student_username", requests[request_id]["student_name"])
         student_info = f"@{student_info}" if "@" not in student_info else student_info
 
-        await bot.edit_forum_topic(
-            chat_id=CURATOR_CHAT_ID,
+        await get_bot().edit_forum_topic(
+            chat_id=forum_id,
             message_thread_id=thread_id,
             name=f"Запит: {student_info} ➤ {curator_info}"
         )
 
-    await bot.send_message(
+    await get_bot().send_message(
         requests[request_id]["student_id"],
         f"✅ Ваш запит взято в роботу куратором. Очікуйте відповідь."
     )
 
 
-@dp.callback_query(F.data.startswith("finish_"))
-async def finish_request(callback_query: CallbackQuery):
+async def finish_request(callback_query: CallbackQuery, request_id: str, state: FSMContext):
     """Куратор закриває запит"""
     curator_id = callback_query.from_user.id
-    request_id = callback_query.data.split("_")[1]
 
     if curator_id not in TEACHERS_IDS:
         await callback_query.answer("У вас немає прав для виконання цієї дії.")
@@ -542,8 +824,9 @@ async def finish_request(callback_query: CallbackQuery):
         await callback_query.answer("Тільки призначений куратор може завершити діалог")
         return
 
-    requests[request_id]["status"] = "Завершено"
-    await log_curator_action(request_id, curator_id, "завершив діалог")
+    requests[request_id]["status"] = STATUS_DONE
+    active_requests.pop(requests[request_id]["student_id"], None)
+    await log_curator_action(request_id, curator_id, ACTION_FINISH)
 
     curator_username = callback_query.from_user.username
     curator_name = callback_query.from_user.full_name
@@ -553,6 +836,7 @@ async def finish_request(callback_query: CallbackQuery):
 
     if not requests[request_id].get("curator_name"):
         requests[request_id]["curator_name"] = curator_name
+    await persist_request(request_id)
 
     curator_info = f"@{requests[request_id]['curator_username']}" if requests[request_id].get("curator_username") else \
         requests[request_id].get("curator_name", "Невідомо")
@@ -561,19 +845,21 @@ async def finish_request(callback_query: CallbackQuery):
 
     # Видаляємо кнопки з поточного повідомлення
     try:
-        await bot.edit_message_reply_markup(
+        await get_bot().edit_message_reply_markup(
             chat_id=callback_query.message.chat.id,
             message_id=callback_query.message.message_id,
             reply_markup=None
         )
     except Exception as e:
-        print(f"Помилка при видаленні кнопок: {e}")
+        logger.warning("Помилка при видаленні кнопок: %s", e)
 
     thread_id = request_threads.get(request_id)
+
+    forum_id = requests[request_id]["chat_id"]
     if thread_id:
         # Оновлюємо інформацію в треді
-        await bot.send_message(
-            chat_id=CURATOR_CHAT_ID,
+        await get_bot().send_message(
+            chat_id=forum_id,
             message_thread_id=thread_id,
             text=f"✅ Запит завершено куратором {curator_info}.\n"
                  f"⏱ Час завершення: {datetime.now(ZoneInfo('Europe/Kiev')).strftime('%Y-%m-%d %H:%M:%S')}",
@@ -584,32 +870,30 @@ async def finish_request(callback_query: CallbackQuery):
         student_info = requests[request_id].get("student_username", requests[request_id]["student_name"])
         student_info = f"@{student_info}" if "@" not in student_info else student_info
 
-        await bot.edit_forum_topic(
-            chat_id=CURATOR_CHAT_ID,
+        await get_bot().edit_forum_topic(
+            chat_id=forum_id,
             message_thread_id=thread_id,
             name=f"[ЗАВЕРШЕНО] {student_info} ➤ {curator_info}"
         )
 
         # Закриваємо тему форуму, якщо така функція підтримується API
         try:
-            await bot.close_forum_topic(
-                chat_id=CURATOR_CHAT_ID,
+            await get_bot().close_forum_topic(
+                chat_id=forum_id,
                 message_thread_id=thread_id
             )
         except Exception as e:
-            print(f"Не вдалося закрити тему форуму: {e}")
+            logger.warning("Не вдалося закрити тему форуму: %s", e)
 
-    await bot.send_message(
+    await get_bot().send_message(
         requests[request_id]["student_id"],
         f"✅ Ваш запит завершено куратором {curator_info}. Дякуємо за звернення!"
     )
 
 
-@dp.callback_query(F.data.startswith("hold_"))
-async def hold_request(callback_query: CallbackQuery):
+async def hold_request(callback_query: CallbackQuery, request_id: str, state: FSMContext):
     """Куратор ставить запит на утримання"""
     curator_id = callback_query.from_user.id
-    request_id = callback_query.data.split("_")[1]
 
     if curator_id not in TEACHERS_IDS:
         await callback_query.answer("У вас немає прав для виконання цієї дії.")
@@ -623,49 +907,41 @@ async def hold_request(callback_query: CallbackQuery):
         await callback_query.answer("Тільки призначений куратор може поставити запит на утримання")
         return
 
-    if requests[request_id].get("status") == "У роботі":
-        requests[request_id]["status"] = "Очікує"
+    if requests[request_id].get("status") == STATUS_IN_WORK:
+        requests[request_id]["status"] = STATUS_ON_HOLD
         assigned_curator = curator_id
     else:
         requests[request_id]["curator_id"] = curator_id
         requests[request_id]["curator_username"] = callback_query.from_user.username
         requests[request_id]["curator_name"] = callback_query.from_user.full_name
-        requests[request_id]["status"] = "Очікує"
+        requests[request_id]["status"] = STATUS_ON_HOLD
         assigned_curator = curator_id
 
-    await log_curator_action(request_id, curator_id, "поставив на утримання")
+    await log_curator_action(request_id, curator_id, ACTION_HOLD)
+    await persist_request(request_id)
     await callback_query.answer("Запит поставлено на утримання")
 
-    curator_keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(text="Відповісти", callback_data=f"reply_{request_id}"),
-                InlineKeyboardButton(text="Завершити діалог", callback_data=f"finish_{request_id}")
-            ],
-            [
-                InlineKeyboardButton(text="Взяти в роботу", callback_data=f"take_{request_id}"),
-                InlineKeyboardButton(text="Переназначити", callback_data=f"reassign_{request_id}")
-            ]
-        ]
-    )
+    curator_keyboard = request_markup(request_id)
 
     curator_info = f"@{callback_query.from_user.username}" if callback_query.from_user.username else callback_query.from_user.full_name
 
     # Видаляємо кнопки з поточного повідомлення
     try:
-        await bot.edit_message_reply_markup(
+        await get_bot().edit_message_reply_markup(
             chat_id=callback_query.message.chat.id,
             message_id=callback_query.message.message_id,
             reply_markup=None
         )
     except Exception as e:
-        print(f"Помилка при видаленні кнопок: {e}")
+        logger.warning("Помилка при видаленні кнопок: %s", e)
 
     thread_id = request_threads.get(request_id)
+
+    forum_id = requests[request_id]["chat_id"]
     if thread_id:
         # Оновлюємо інформацію в треді
-        await bot.send_message(
-            chat_id=CURATOR_CHAT_ID,
+        await get_bot().send_message(
+            chat_id=forum_id,
             message_thread_id=thread_id,
             text=f"⏸ Запит поставлено на утримання куратором {curator_info}.\n"
                  f"⏱ Час: {datetime.now(ZoneInfo('Europe/Kiev')).strftime('%Y-%m-%d %H:%M:%S')}",
@@ -676,23 +952,21 @@ async def hold_request(callback_query: CallbackQuery):
         student_info = requests[request_id].get("student_username", requests[request_id]["student_name"])
         student_info = f"@{student_info}" if "@" not in student_info else student_info
 
-        await bot.edit_forum_topic(
-            chat_id=CURATOR_CHAT_ID,
+        await get_bot().edit_forum_topic(
+            chat_id=forum_id,
             message_thread_id=thread_id,
             name=f"[НА УТРИМАННІ] {student_info} ➤ {curator_info}"
         )
 
-    await bot.send_message(
+    await get_bot().send_message(
         requests[request_id]["student_id"],
         "⏳ Ваш запит поставлено на утримання. Куратор повернеться до вас пізніше."
     )
 
 
-@dp.callback_query(F.data.startswith("reassign_"))
-async def reassign_request(callback_query: CallbackQuery):
+async def reassign_request(callback_query: CallbackQuery, request_id: str, state: FSMContext):
     """Переназначити куратора для запиту"""
     curator_id = callback_query.from_user.id
-    request_id = callback_query.data.split("_")[1]
 
     if curator_id not in TEACHERS_IDS:
         await callback_query.answer("У вас немає прав для виконання цієї дії.")
@@ -715,36 +989,35 @@ async def reassign_request(callback_query: CallbackQuery):
             "curator_username") else requests[request_id].get("curator_name", "Невідомо")
 
     requests[request_id]["curator_id"] = None
-    requests[request_id]["status"] = "Очікує обробки"
+    requests[request_id]["status"] = STATUS_NEW
 
-    await log_curator_action(request_id, curator_id, "переназначив запит")
+    await log_curator_action(request_id, curator_id, ACTION_REASSIGN)
+    await persist_request(request_id)
     await callback_query.answer("Запит доступний для інших кураторів")
 
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Взяти в роботу", callback_data=f"take_{request_id}")],
-        ]
-    )
+    keyboard = request_markup(request_id)
 
     # Видаляємо кнопки з поточного повідомлення
     try:
-        await bot.edit_message_reply_markup(
+        await get_bot().edit_message_reply_markup(
             chat_id=callback_query.message.chat.id,
             message_id=callback_query.message.message_id,
             reply_markup=None
         )
     except Exception as e:
-        print(f"Помилка при видаленні кнопок: {e}")
+        logger.warning("Помилка при видаленні кнопок: %s", e)
 
     thread_id = request_threads.get(request_id)
+
+    forum_id = requests[request_id]["chat_id"]
     if thread_id:
         # Оновлюємо інформацію в треді
         reassign_text = f"🔄 Запит переназначено куратором @{callback_query.from_user.username or callback_query.from_user.full_name}."
         if prev_curator_info:
             reassign_text += f"\nПопередній куратор: {prev_curator_info}"
 
-        await bot.send_message(
-            chat_id=CURATOR_CHAT_ID,
+        await get_bot().send_message(
+            chat_id=forum_id,
             message_thread_id=thread_id,
             text=f"{reassign_text}\n⏱ Час: {datetime.now(ZoneInfo('Europe/Kiev')).strftime('%Y-%m-%d %H:%M:%S')}\n\nЗапит доступний для взяття в роботу:",
             reply_markup=keyboard
@@ -754,21 +1027,246 @@ async def reassign_request(callback_query: CallbackQuery):
         student_info = requests[request_id].get("student_username", requests[request_id]["student_name"])
         student_info = f"@{student_info}" if "@" not in student_info else student_info
 
-        await bot.edit_forum_topic(
-            chat_id=CURATOR_CHAT_ID,
+        await get_bot().edit_forum_topic(
+            chat_id=forum_id,
             message_thread_id=thread_id,
             name=f"[ДОСТУПНИЙ] Запит: {student_info}"
         )
 
-    await bot.send_message(
+    await get_bot().send_message(
         requests[request_id]["student_id"],
         "🔄 Ваш запит переназначено. Очікуйте, інший куратор прийме його в роботу."
     )
 
 
+REQUEST_ACTIONS = {
+    Action.TAKE: take_request,
+    Action.REPLY: ask_for_reply,
+    Action.FINISH: finish_request,
+    Action.HOLD: hold_request,
+    Action.REASSIGN: reassign_request,
+}
+
+
+@dp.callback_query(RequestCallback.filter())
+async def handle_request_callback(callback_query: CallbackQuery, callback_data: RequestCallback,
+                                  state: FSMContext):
+    """Єдина точка входу для кнопок запиту: дія обирається за таблицею REQUEST_ACTIONS."""
+    request_id = str(callback_data.request_id)
+    bind_request(request_id)
+    await REQUEST_ACTIONS[callback_data.action](callback_query, request_id, state)
+
+
+async def load_roster():
+    """Складає TEACHERS_IDS з кураторів .env і активних кураторів, збережених у БД."""
+    teachers = await get_all_teachers()
+    roster = [*CONFIG_TEACHERS_IDS, *(int(teacher.telegram_id) for teacher in teachers)]
+    TEACHERS_IDS[:] = list(dict.fromkeys(roster))
+
+
+async def load_open_requests():
+    """Відновлює незавершені запити з БД у кеш requests."""
+    for record in await get_open_requests():
+        # Тему не створено - процес зупинився посередині; запит закриє власник опитування
+        if not record.thread_id:
+            continue
+        request_id = str(record.id)
+        created_at = (record.created_at or datetime.utcnow()).replace(tzinfo=timezone.utc)
+        requests[request_id] = {
+            "student_id": int(record.student_id),
+            "student_name": record.student_name,
+            "student_username": record.student_username,
+            "status": record.status,
+            # Запити, створені до появи кількох форумів, жили в CURATOR_CHAT_ID
+            "chat_id": record.chat_id or CURATOR_CHAT_ID or shard_router.default_chat_id,
+            "curator_id": int(record.curator_id) if record.curator_id else None,
+            "curator_username": record.curator_username,
+            "curator_name": record.curator_name,
+            "messages": [{"from": "student", "time": created_at.isoformat()}]
+        }
+        request_threads[request_id] = record.thread_id
+        active_requests[int(record.student_id)] = request_id
+
+
+async def load_snippets():
+    snippet_index.build(await get_snippets())
+
+
+async def load_fsm():
+    await storage.load()
+
+
+async def reload_state():
+    """Перечитує стан, який попередній процес міг змінити вже після нашого прогріву."""
+    requests.clear()
+    request_threads.clear()
+    active_requests.clear()
+    await asyncio.gather(load_roster(), load_open_requests(), load_snippets(), load_fsm())
+
+
+def start_jobs(task: asyncio.Task):
+    """Після прогріву у власника опитування: перервані розсилки й планувальник."""
+    if task.cancelled() or lifecycle.stopping:
+        return
+    asyncio.create_task(broadcast.resume_jobs(get_bot()))
+    scheduler.start()
+
+
+def digest_job(title: str):
+    async def send(since: datetime, until: datetime):
+        text = await build_digest(title, since, until, SLA_MINUTES, STALE_HOLD_HOURS)
+        recipients = ([ADMIN_ID] if ADMIN_ID else []) + shard_router.chat_ids
+        await send_digest(get_bot(), recipients, text)
+    return send
+
+
+scheduler = Scheduler()
+if DIGEST_DAILY_AT:
+    scheduler.add("daily_digest", f"daily {DIGEST_DAILY_AT}", digest_job("Щоденний звіт"))
+if DIGEST_WEEKLY_AT:
+    scheduler.add("weekly_digest", f"weekly {DIGEST_WEEKLY_AT}", digest_job("Тижневий звіт"))
+
+
+def warm_up() -> asyncio.Task:
+    """Перевірка схеми, потім паралельне завантаження кешів; оновлення чекають на завершення."""
+    return startup.start(init_db, load_roster, load_open_requests, load_snippets, load_fsm)
+
+
+@dp.callback_query(SnippetCallback.filter())
+async def send_snippet(callback_query: CallbackQuery, callback_data: SnippetCallback):
+    """Куратор надсилає студенту шаблонну відповідь одним натисканням."""
+    request_id = str(callback_data.request_id)
+    bind_request(request_id)
+    curator_id = callback_query.from_user.id
+
+    if curator_id not in TEACHERS_IDS:
+        await callback_query.answer("У вас немає прав для виконання цієї дії.")
+        return
+
+    if request_id not in requests or requests[request_id]["status"] == STATUS_DONE:
+        await callback_query.answer("Запит не знайдено")
+        return
+
+    assigned_curator = requests[request_id].get("curator_id")
+    if assigned_curator is not None and assigned_curator != curator_id:
+        await callback_query.answer("Тільки призначений куратор може відповісти на запит")
+        return
+
+    snippet = snippet_index.snippets.get(callback_data.snippet_id)
+    if snippet is None:
+        await callback_query.answer("Шаблон видалено")
+        return
+
+    title, text = snippet
+    logger.info("Надіслано шаблонну відповідь", extra={"curator_id": curator_id, "snippet_id": callback_data.snippet_id})
+    try:
+        await send_curator_reply(request_id, callback_query.from_user, text, datetime.now(timezone.utc),
+                                 label=f"відповів шаблоном «{title}»")
+    except Exception:
+        logger.exception("Помилка при надсиланні шаблонної відповіді",
+                         extra={"student_id": requests[request_id]["student_id"]})
+        await callback_query.answer("⚠ Помилка при надсиланні відповіді")
+        return
+    await callback_query.answer("Відповідь надіслано")
+
+
+@dp.callback_query(HistoryCallback.filter())
+async def show_history(callback_query: CallbackQuery, callback_data: HistoryCallback):
+    """Сторінка попередніх звернень студента в треді запиту."""
+    request_id = str(callback_data.request_id)
+    bind_request(request_id)
+
+    if callback_query.from_user.id not in TEACHERS_IDS:
+        await callback_query.answer("У вас немає прав для виконання цієї дії.")
+        return
+
+    if request_id not in requests:
+        await callback_query.answer("Запит не знайдено")
+        return
+
+    cursor = (callback_data.before_time, callback_data.before_id) if callback_data.before_id else None
+    page = await history_pages.get(requests[request_id]["student_id"], request_id, cursor)
+    if page is None:
+        await callback_query.answer("⚠ Не вдалося завантажити історію")
+        return
+
+    messages, next_cursor = page
+    if not messages:
+        await callback_query.answer("Попередніх звернень немає")
+        return
+
+    page_number = max(callback_data.page, 1)
+    text = render_page(messages, page_number)
+    keyboard = history_keyboard(callback_data.request_id, page_number, next_cursor)
+    await callback_query.answer()
+
+    if callback_data.page == 0:
+        await get_bot().send_message(
+            chat_id=requests[request_id]["chat_id"],
+            message_thread_id=request_threads.get(request_id),
+            text=text,
+            reply_markup=keyboard
+        )
+        return
+
+    try:
+        await get_bot().edit_message_text(
+            chat_id=callback_query.message.chat.id,
+            message_id=callback_query.message.message_id,
+            text=text,
+            reply_markup=keyboard
+        )
+    except Exception as e:
+        logger.warning("Не вдалося оновити сторінку історії: %s", e)
+
+
 async def main():
-    await init_db()
-    await dp.start_polling(bot)
+    setup_logging()
+    if not TOKEN or not TEACHERS_IDS or not shard_router.shards:
+        raise ValueError("BOT_TOKEN, TEACHERS_IDS або CURATOR_CHAT_ID не знайдено в .env файлі")
+
+    startup.mark("main_started")
+    bot = get_bot()
+    bot.session.middleware(ShardRateLimiter(shard_router))
+    bot.session.middleware(profiler.api_timer)
+    if PROFILE_ENABLED:
+        profiler.enable(get_engine())
+    # Кеші прогріваються паралельно з очікуванням оренди опитування й першим getUpdates
+    warm_up()
+    lifecycle.install_signals(dp)
+    try:
+        if await lifecycle.take_over(dp, startup, reload_state):
+            # Запити без теми лишив процес, зупинений посередині створення;
+            # їхні оновлення дообробляться як нові запити (replay нижче)
+            closed = await close_topicless_requests()
+            if closed:
+                logger.warning("Закрито запити без теми", extra={"count": closed})
+            # Розсилки й планувальник - лише у власника опитування, інакше вони
+            # продовжувалися б одночасно з попереднім процесом
+            startup.task.add_done_callback(start_jobs)
+            lifecycle.replay(dp, bot)
+            # Сигнал міг прийти під час перечитування стану, ще до старту опитування
+            # (а після цієї перевірки його підхопить lifecycle.on_polling_started)
+            if not lifecycle.stopping:
+                await dp.start_polling(bot, handle_signals=False, close_bot_session=False)
+    finally:
+        # Опитування вже зупинене: дочікуємо розпочате, потім передаємо заміні offset,
+        # необроблені оновлення та оренду
+        await asyncio.gather(
+            lifecycle.drain(SHUTDOWN_TIMEOUT),
+            broadcast.stop_jobs(SHUTDOWN_TIMEOUT),
+            scheduler.stop(SHUTDOWN_TIMEOUT),
+        )
+        await lifecycle.hand_over(bot)
+        if not startup.task.done():
+            startup.task.cancel()
+        profiler.disable()
+        if recorder:
+            await recorder.close()
+        await bot.session.close()
+        await close_db()
+        logger.info("Бот зупинений", extra=dict(lifecycle.stats))
+        shutdown_logging()
 
 
 if __name__ == "__main__":
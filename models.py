@@ -1,10 +1,13 @@
 from datetime import datetime
 
-from sqlalchemy import Column, Integer, String, Text, DateTime
+from sqlalchemy import BigInteger, Boolean, Column, Index, Integer, String, Text, DateTime
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
+# Збільшується при кожній зміні моделей: при старті DDL виконується лише для застарілої схеми
+SCHEMA_VERSION = 10
+
 
 class CuratorLog(Base):
     __tablename__ = 'curator_logs'
@@ -13,18 +16,27 @@ class CuratorLog(Base):
     request_id = Column(String(50), nullable=False)
     curator_id = Column(String(30), nullable=False)
     action = Column(String(50), nullable=False)
-    action_time = Column(DateTime, default=datetime.utcnow)
+    # Індекс для звітів, що читають лише дії після попереднього запуску
+    action_time = Column(DateTime, default=datetime.utcnow, index=True)
 
 
 class CuratorMessage(Base):
     __tablename__ = 'curator_messages'
+    __table_args__ = (
+        # Сторінки історії студента за ключем (message_time, id)
+        Index("ix_curator_messages_student", "student_id", "message_time", "id"),
+        Index("ix_curator_messages_request_time", "request_id", "message_time", "id"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     request_id = Column(String(50), nullable=False)
+    # Студент, чий це запит (і для відповідей куратора); NULL лише в старих рядках,
+    # які не вдалося однозначно віднести до студента
+    student_id = Column(String(30), nullable=True)
     sender_id = Column(String(30), nullable=False)
     sender_type = Column(String(20), nullable=False)  # "student" або "curator"
     message_text = Column(Text, nullable=False)
-    message_time = Column(DateTime, default=datetime.utcnow)
+    message_time = Column(DateTime, default=datetime.utcnow, index=True)
 
 
 class Teacher(Base):
@@ -34,4 +46,110 @@ class Teacher(Base):
     telegram_id = Column(String(30), unique=True, nullable=False)
     username = Column(String(100), nullable=True)
     full_name = Column(String(100), nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    is_active = Column(Boolean, nullable=False, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class BroadcastJob(Base):
+    __tablename__ = 'broadcast_jobs'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    text = Column(Text, nullable=False)
+    audience = Column(String(20), nullable=False)  # "all", "students" або "active"
+    status = Column(String(20), nullable=False, default="running")  # "running", "done" або "cancelled"
+    created_by = Column(String(30), nullable=False)
+    # Останній оброблений sender_id: розсилка після перезапуску продовжується з наступного
+    cursor = Column(String(30), nullable=True)
+    total = Column(Integer, nullable=False, default=0)
+    delivered = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    blocked = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class StudentRequest(Base):
+    """Стан запиту, щоб після перезапуску відкриті запити піднімалися з БД.
+
+    id - єдиний для всього бота номер запиту: message_id унікальний лише в межах
+    чату, тож запити різних студентів могли мати однаковий ключ (старі запити
+    з таблиці student_requests переносяться сюди при оновленні схеми).
+    """
+    __tablename__ = 'requests'
+    # AUTOINCREMENT у SQLite: номери не повторюються навіть після видалення рядків
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    student_id = Column(String(30), nullable=False)
+    student_name = Column(String(200), nullable=True)
+    student_username = Column(String(100), nullable=True)
+    # Форум кураторів, у якому відкрито тему запиту (див. shards.py)
+    chat_id = Column(BigInteger, nullable=True)
+    thread_id = Column(Integer, nullable=True)
+    status = Column(String(30), nullable=False, index=True)
+    curator_id = Column(String(30), nullable=True)
+    curator_username = Column(String(100), nullable=True)
+    curator_name = Column(String(200), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class Snippet(Base):
+    """Шаблонна відповідь, яку куратор надсилає студенту одним натисканням."""
+    __tablename__ = 'snippets'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    title = Column(String(100), nullable=False)
+    text = Column(Text, nullable=False)
+    created_by = Column(String(30), nullable=False)
+    is_active = Column(Boolean, nullable=False, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class ScheduledTask(Base):
+    """Час останнього запуску задачі планувальника (див. scheduler.py)."""
+    __tablename__ = 'scheduled_tasks'
+
+    name = Column(String(50), primary_key=True)
+    last_run_at = Column(DateTime, nullable=False)
+
+
+class BotState(Base):
+    """Службові значення процесу бота, що переживають перезапуск (див. lifecycle.py)."""
+    __tablename__ = 'bot_state'
+
+    key = Column(String(50), primary_key=True)
+    value = Column(BigInteger, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class PendingUpdate(Base):
+    """Оновлення, яке процес не встиг обробити до зупинки: його дообробляє процес-заміна."""
+    __tablename__ = 'pending_updates'
+
+    update_id = Column(BigInteger, primary_key=True)
+    payload = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class FsmRecord(Base):
+    """Стан FSM користувача (див. fsm_storage.py), щоб він пережив заміну процесу."""
+    __tablename__ = 'fsm_states'
+
+    key = Column(String(200), primary_key=True)
+    bot_id = Column(BigInteger, nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    user_id = Column(BigInteger, nullable=False)
+    thread_id = Column(BigInteger, nullable=True)
+    business_connection_id = Column(String(100), nullable=True)
+    destiny = Column(String(50), nullable=False)
+    state = Column(String(100), nullable=True)
+    data = Column(Text, nullable=False, default="{}")
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,271 @@
+"""Профілювання на вимогу: затримка циклу подій, повільні обробники і розбивка часу.
+
+Вимкнено за замовчуванням (PROFILE_ENABLED) і перемикається командою /profile.
+Коли ввімкнено:
+  - монітор циклу подій раз на LAG_INTERVAL міряє, наскільки пізно прокидається sleep;
+  - кожен обробник отримує трасу: час у БД (запити SQLAlchemy і очікування черги
+    записів), у Bot API (middleware сесії бота) і решта - Python;
+  - для обробника, довшого за поріг, зберігається стек корутини в момент перевищення
+    порогу (режим "stack") або профіль cProfile усього виклику (режим "cprofile").
+Коли вимкнено, middleware лише перевіряє прапорець, а слухачі SQLAlchemy і монітор
+циклу не встановлені.
+"""
+import asyncio
+import cProfile
+import io
+import logging
+import pstats
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from sqlalchemy import event
+
+from keyboards import RequestCallback
+
+logger = logging.getLogger("bot.profiling")
+
+LAG_INTERVAL = 0.1
+# Затримка циклу, про яку варто попередити в лог
+LAG_WARNING = 0.1
+MODES = ("stack", "cprofile")
+# Скільки найглибших кадрів зберігати у зразку стеку
+SAMPLE_DEPTH = 15
+
+current_trace = ContextVar("profile_trace", default=None)
+
+
+def handler_name(data: dict) -> str:
+    """Назва обробника; кнопки запитів мають один обробник, тож до назви додається дія."""
+    name = data["handler"].callback.__name__
+    callback_data = data.get("callback_data")
+    if isinstance(callback_data, RequestCallback):
+        name = f"{name}:{callback_data.action.name.lower()}"
+    return name
+
+
+class Trace:
+    __slots__ = ("name", "started", "duration", "spans", "sample")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.spans = []
+        self.sample = None
+
+    def add(self, kind: str, name: str, started: float, duration: float):
+        self.spans.append((kind, name, started - self.started, duration))
+
+    def totals(self) -> dict:
+        totals = {"db": 0.0, "api": 0.0}
+        for kind, _, _, duration in self.spans:
+            totals[kind] += duration
+        totals["python"] = max(0.0, self.duration - totals["db"] - totals["api"])
+        return totals
+
+    def render(self) -> str:
+        """Дерево часу: обробник, його виклики БД і Bot API по черзі, решта - Python."""
+        lines = [f"{self.name} {self.duration * 1000:.0f} мс"]
+        for kind, name, offset, duration in self.spans:
+            lines.append(f"├ +{offset * 1000:.0f} мс {kind} {name} {duration * 1000:.1f} мс")
+        lines.append(f"└ python {self.totals()['python'] * 1000:.0f} мс")
+        return "\n".join(lines)
+
+
+@contextmanager
+def span(kind: str, name: str):
+    """Записує ділянку коду в трасу поточного обробника (якщо профілювання ввімкнене)."""
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(kind, name, started, time.perf_counter() - started)
+
+
+class ApiTimer(BaseRequestMiddleware):
+    """Middleware сесії бота: час кожного виклику Bot API в трасі обробника."""
+
+    async def __call__(self, make_request, bot, method):
+        if current_trace.get() is None:
+            return await make_request(bot, method)
+        with span("api", method.__api_method__):
+            return await make_request(bot, method)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_trace.get() is not None:
+        conn.info.setdefault("profile_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    trace = current_trace.get()
+    pending = conn.info.get("profile_started")
+    if trace is not None and pending:
+        started = pending.pop()
+        trace.add("db", statement.split(None, 1)[0], started, time.perf_counter() - started)
+
+
+class Profiler(BaseMiddleware):
+    def __init__(self, slow_ms: float = 500, mode: str = "stack", keep_slow: int = 20):
+        if mode not in MODES:
+            raise ValueError(f"Невідомий режим профілювання: {mode}")
+        self.enabled = False
+        self.slow_seconds = slow_ms / 1000
+        self.mode = mode
+        self.api_timer = ApiTimer()
+        self._keep_slow = keep_slow
+        self._engine = None
+        self._lag_task = None
+        self._profiling = False
+        self.reset()
+
+    def reset(self):
+        self.since = time.monotonic()
+        self.handlers = defaultdict(lambda: {"count": 0, "total": 0.0, "max": 0.0, "db": 0.0, "api": 0.0})
+        self.slow = deque(maxlen=self._keep_slow)
+        self.lags = deque(maxlen=3000)
+
+    def enable(self, engine=None, slow_ms: float = None, mode: str = None):
+        if slow_ms is not None:
+            self.slow_seconds = slow_ms / 1000
+        if mode is not None:
+            if mode not in MODES:
+                raise ValueError(f"Невідомий режим профілювання: {mode}")
+            self.mode = mode
+        if self.enabled:
+            return
+        self.enabled = True
+        self.reset()
+        if engine is not None:
+            self._engine = engine.sync_engine
+            event.listen(self._engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(self._engine, "after_cursor_execute", _after_cursor_execute)
+        self._lag_task = asyncio.create_task(self._monitor_lag())
+        logger.info("Профілювання ввімкнено", extra={"mode": self.mode, "slow_ms": self.slow_seconds * 1000})
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        if self._engine is not None:
+            event.remove(self._engine, "before_cursor_execute", _before_cursor_execute)
+            event.remove(self._engine, "after_cursor_execute", _after_cursor_execute)
+            self._engine = None
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+        logger.info("Профілювання вимкнено")
+
+    async def _monitor_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(LAG_INTERVAL)
+            lag = loop.time() - started - LAG_INTERVAL
+            self.lags.append(lag)
+            if lag > LAG_WARNING:
+                logger.warning("Цикл подій заблоковано на %.0f мс", lag * 1000)
+
+    @staticmethod
+    def _sample(trace: Trace, task: asyncio.Task):
+        """Ланцюжок await обробника в момент, коли він перевищив поріг.
+
+        Task.print_stack показує лише зовнішню корутину, тож ланцюжок іде по cr_await
+        до місця, де обробник зараз чекає.
+        """
+        frames = []
+        awaitable = task.get_coro()
+        while awaitable is not None:
+            frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+            if frame is None:
+                break
+            frames.append(f"  {frame.f_code.co_filename}:{frame.f_lineno} {frame.f_code.co_name}")
+            awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+        trace.sample = "\n".join(frames[-SAMPLE_DEPTH:])
+
+    async def __call__(self, handler, event, data):
+        if not self.enabled:
+            return await handler(event, data)
+
+        trace = Trace(handler_name(data))
+        token = current_trace.set(trace)
+        timer = profile = None
+        if self.mode == "stack":
+            timer = asyncio.get_running_loop().call_later(
+                self.slow_seconds, self._sample, trace, asyncio.current_task()
+            )
+        elif not self._profiling:
+            # cProfile бачить увесь потік, тож одночасно профілюється лише один обробник
+            self._profiling = True
+            profile = cProfile.Profile()
+            profile.enable()
+        try:
+            return await handler(event, data)
+        finally:
+            current_trace.reset(token)
+            trace.duration = time.perf_counter() - trace.started
+            if timer is not None:
+                timer.cancel()
+            if profile is not None:
+                profile.disable()
+                self._profiling = False
+                if trace.duration >= self.slow_seconds:
+                    buffer = io.StringIO()
+                    pstats.Stats(profile, stream=buffer).sort_stats("cumulative").print_stats(15)
+                    trace.sample = buffer.getvalue()
+            self._record(trace)
+
+    def _record(self, trace: Trace):
+        totals = trace.totals()
+        stats = self.handlers[trace.name]
+        stats["count"] += 1
+        stats["total"] += trace.duration
+        stats["max"] = max(stats["max"], trace.duration)
+        stats["db"] += totals["db"]
+        stats["api"] += totals["api"]
+        if trace.duration >= self.slow_seconds:
+            self.slow.append(trace)
+            logger.warning("Повільний обробник", extra={
+                "handler": trace.name,
+                "duration_ms": round(trace.duration * 1000),
+                **{f"{kind}_ms": round(value * 1000) for kind, value in totals.items()},
+            })
+
+    def report(self, top: int = 5) -> str:
+        state = "увімкнено" if self.enabled else "вимкнено"
+        lines = [f"🔬 Профілювання {state}, режим {self.mode}, поріг {self.slow_seconds * 1000:.0f} мс, "
+                 f"дані за {int(time.monotonic() - self.since)} с"]
+
+        if self.lags:
+            lags = sorted(self.lags)
+            lines.append(f"Затримка циклу подій: p50 {lags[len(lags) // 2] * 1000:.1f} мс, "
+                         f"p99 {lags[int(len(lags) * 0.99)] * 1000:.1f} мс, max {lags[-1] * 1000:.1f} мс")
+
+        lines.append("\nОбробники за сумарним часом:")
+        if not self.handlers:
+            lines.append("  даних ще немає")
+        for name, stats in sorted(self.handlers.items(), key=lambda item: -item[1]["total"])[:top * 2]:
+            total = stats["total"] or 1e-9
+            python = max(0.0, total - stats["db"] - stats["api"])
+            lines.append(
+                f"  {name}: n={stats['count']}, середнє {total / stats['count'] * 1000:.0f} мс, "
+                f"max {stats['max'] * 1000:.0f} мс | БД {stats['db'] / total:.0%}, "
+                f"API {stats['api'] / total:.0%}, Python {python / total:.0%}"
+            )
+
+        if self.slow:
+            lines.append("\nНайповільніші виклики:")
+            for trace in sorted(self.slow, key=lambda item: -item.duration)[:top]:
+                lines.append(trace.render())
+                if trace.sample:
+                    lines.append(trace.sample.rstrip())
+                lines.append("")
+        return "\n".join(lines)
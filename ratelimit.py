@@ -0,0 +1,75 @@
+"""Відро токенів для обмеження частоти викликів Bot API."""
+import asyncio
+import time
+
+
+class TokenBucket:
+    """rate токенів на секунду, не більше capacity у запасі.
+
+    acquire() чекає на токен (черга очікування FIFO), try_acquire() не чекає.
+    acquire(priority=True) - окрема черга, яка отримує наступний токен раніше за
+    звичайну: термінові виклики не стоять за довгою чергою фонових.
+    pause() зупиняє видачу токенів, наприклад після відповіді 429 з retry_after.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self._priority_lock = asyncio.Lock()
+        self._priority_waiting = 0
+        self._priority_idle = asyncio.Event()
+        self._priority_idle.set()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        now = time.monotonic()
+        if now < self.paused_until:
+            return False
+        self._refill(now)
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    async def acquire(self, tokens: float = 1, priority: bool = False):
+        if not priority:
+            async with self._lock:
+                await self._take(tokens, yield_to_priority=True)
+            return
+        self._priority_waiting += 1
+        self._priority_idle.clear()
+        try:
+            async with self._priority_lock:
+                await self._take(tokens)
+        finally:
+            self._priority_waiting -= 1
+            if not self._priority_waiting:
+                self._priority_idle.set()
+
+    async def _take(self, tokens: float, yield_to_priority: bool = False):
+        while True:
+            if yield_to_priority and self._priority_waiting:
+                await self._priority_idle.wait()
+                continue
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return
+            await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        now = time.monotonic()
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0.0
+        self.updated = now
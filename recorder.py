@@ -0,0 +1,175 @@
+"""Запис вхідних оновлень у стиснений JSONL для подальшого відтворення (replay.py).
+
+Вмикається змінною RECORD_UPDATES=/шлях/до/updates.jsonl.gz. Кожен процес пише
+власний файл з часом старту в імені (updates-20261019-090000-1234.jsonl.gz):
+псевдоніми і відлік часу діють лише в межах одного запуску. Ідентифікатори
+користувачів і чатів замінюються стабільними псевдонімами, імена - на
+позначки, текст і назви тем форуму маскуються зі збереженням довжини.
+Крім оновлень, пишеться, якому студентові видано кожен номер запиту: за цим
+replay.py зіставляє номери з callback-даних з номерами в БД відтворення.
+"""
+import asyncio
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+from aiogram import BaseMiddleware
+
+logger = logging.getLogger("bot.recorder")
+
+RECORDING_VERSION = 2
+
+# Ключі, під якими в оновленні лежать користувачі та чати. Крім них, користувачем
+# чи чатом вважається будь-який об'єкт із числовим id та is_bot або типом чату (is_identity)
+IDENTITY_KEYS = {
+    "from", "chat", "user", "users", "sender_chat", "sender_user", "sender_business_bot",
+    "forward_from", "forward_from_chat", "via_bot", "new_chat_members", "left_chat_member",
+}
+CHAT_TYPES = {"private", "group", "supergroup", "channel"}
+# Імена та підписи замінюються псевдонімами будь-де в оновленні
+NAME_KEYS = {"first_name", "last_name", "username", "title", "sender_user_name", "author_signature", "custom_title"}
+TEXT_KEYS = {"text", "caption"}
+# Службові об'єкти тем: назва теми містить ім'я та @username студента
+TOPIC_KEYS = {"forum_topic_created", "forum_topic_edited"}
+DROPPED_KEYS = {"contact", "location", "venue", "photo", "document", "voice", "video", "video_note", "audio"}
+
+
+class Anonymizer:
+    """Стабільно (в межах одного запису) замінює персональні дані в оновленні."""
+
+    def __init__(self, salt: bytes):
+        self.salt = salt
+
+    def pseudo_id(self, value: int) -> int:
+        digest = hmac.new(self.salt, str(abs(value)).encode(), hashlib.sha256).digest()
+        pseudo = int.from_bytes(digest[:5], "big") + 1
+        # Зберігаємо знак, бо від нього залежить тип чату (приватний чи група)
+        return -pseudo if value < 0 else pseudo
+
+    def pseudo_name(self, value: str) -> str:
+        return "u" + hmac.new(self.salt, value.encode(), hashlib.sha256).hexdigest()[:10]
+
+    @staticmethod
+    def mask_text(value: str) -> str:
+        return "".join(ch if ch.isspace() else "x" for ch in value)
+
+    @staticmethod
+    def is_identity(data: dict) -> bool:
+        return isinstance(data.get("id"), int) and ("is_bot" in data or data.get("type") in CHAT_TYPES)
+
+    def anonymize(self, data, identity: bool = False, topic: bool = False):
+        if isinstance(data, list):
+            return [self.anonymize(item, identity, topic) for item in data]
+        if not isinstance(data, dict):
+            return data
+
+        identity = identity or self.is_identity(data)
+        result = {}
+        for key, value in data.items():
+            if key in DROPPED_KEYS:
+                continue
+            if identity and key == "id" and isinstance(value, int):
+                result[key] = self.pseudo_id(value)
+            elif key in NAME_KEYS and isinstance(value, str):
+                result[key] = self.pseudo_name(value)
+            elif (key in TEXT_KEYS or topic and key == "name") and isinstance(value, str):
+                result[key] = self.mask_text(value)
+            else:
+                result[key] = self.anonymize(value, key in IDENTITY_KEYS, key in TOPIC_KEYS)
+        return result
+
+
+def session_path(path: str, started: datetime, pid: int) -> str:
+    """Шлях файлу одного запуску: до імені перед розширенням додаються час старту і pid."""
+    directory, name = os.path.split(path)
+    stem, dot, suffix = name.partition(".")
+    return os.path.join(directory, f"{stem}-{started.strftime('%Y%m%d-%H%M%S')}-{pid}{dot}{suffix}")
+
+
+class UpdateRecorder(BaseMiddleware):
+    """Зовнішній middleware на dp.update, що пише кожне оновлення з міткою часу.
+
+    Запис у файл виконується пачками в окремому потоці, щоб не блокувати цикл подій.
+    """
+
+    def __init__(self, path: str, teacher_ids=(), curator_chat_id=None, flush_every: int = 100):
+        self.path = session_path(path, datetime.now(), os.getpid())
+        self.flush_every = flush_every
+        self.anonymizer = Anonymizer(os.urandom(16))
+        self.started = time.monotonic()
+        self._buffer = []
+        self._lock = asyncio.Lock()
+        # "x": дописування до чужого запису змішало б сесії з різними псевдонімами
+        self._file = gzip.open(self.path, "xt", encoding="utf-8")
+        logger.info("Запис оновлень", extra={"path": self.path})
+        self._buffer.append(json.dumps({
+            "type": "header",
+            "version": RECORDING_VERSION,
+            "started_at": time.time(),
+            "teachers": [self.anonymizer.pseudo_id(i) for i in teacher_ids],
+            "curator_chat_id": self.anonymizer.pseudo_id(curator_chat_id) if curator_chat_id else None,
+        }))
+
+    async def __call__(self, handler, event, data):
+        record = {
+            "t": round(time.monotonic() - self.started, 4),
+            "update": self.anonymizer.anonymize(event.model_dump(mode="json", by_alias=True, exclude_none=True)),
+        }
+        self._buffer.append(json.dumps(record, ensure_ascii=False))
+        if len(self._buffer) >= self.flush_every:
+            asyncio.create_task(self.flush())
+        return await handler(event, data)
+
+    def note_request(self, request_id, student_id: int):
+        """Записує видачу номера запиту студентові (викликається після create_request)."""
+        self._buffer.append(json.dumps({
+            "type": "request",
+            "t": round(time.monotonic() - self.started, 4),
+            "request_id": int(request_id),
+            "student": self.anonymizer.pseudo_id(student_id),
+        }))
+
+    def _write(self, lines):
+        self._file.write("\n".join(lines) + "\n")
+        self._file.flush()
+
+    async def flush(self):
+        async with self._lock:
+            if not self._buffer:
+                return
+            lines, self._buffer = self._buffer, []
+            await asyncio.to_thread(self._write, lines)
+
+    async def close(self):
+        await self.flush()
+        await asyncio.to_thread(self._file.close)
+
+
+def read_recording(path: str):
+    """Повертає (заголовок, записи оновлень, видані номери запитів) з файлу запису."""
+    header = None
+    records = []
+    requests = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if item.get("type") == "header":
+                if header is not None:
+                    raise ValueError(f"У файлі {path} кілька сесій запису з різними псевдонімами")
+                header = item
+            elif item.get("type") == "request":
+                requests.append(item)
+            else:
+                records.append(item)
+    if header is None:
+        raise ValueError(f"У файлі {path} немає заголовка запису")
+    records.sort(key=lambda item: item["t"])
+    requests.sort(key=lambda item: item["t"])
+    return header, records, requests
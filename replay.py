@@ -0,0 +1,275 @@
+"""Відтворення записаного потоку оновлень (recorder.py) через dp.
+
+Оновлення подаються з початковими інтервалами, прискореними у --speed разів
+(або без пауз при --speed max), на локальну SQLite базу і симулятор Bot API.
+Приклад:
+    python replay.py exam-week.jsonl.gz --speed 10 --json replay.json
+
+База відтворення порожня, тож запити отримують інші номери, ніж у робочій БД.
+Номери в callback-даних кнопок ("r:", "s:", "h:") замінюються на видані при
+відтворенні (див. RequestIds). Курсор гортання історії ("h:" зі сторінкою 1+)
+посилається на повідомлення робочої БД і не переноситься.
+
+Захист від флуду (main.flood_control) за замовчуванням вимкнено: при прискоренні
+він відкидав би записані оновлення, і профіль обробників не відповідав би запису.
+З --flood-control він працює, як у боті, а його лічильники потрапляють у звіт.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from aiogram.types import Update
+
+from fake_api import FakeBotAPI
+from keyboards import HistoryCallback, RequestCallback, SnippetCallback
+from loadtest import UpdateTimer, HandlerTimer, percentile, prepare_env
+from recorder import read_recording
+
+
+def sender_key(update: dict):
+    """Ідентифікатор відправника оновлення, щоб зберегти порядок його подій."""
+    for kind in ("message", "callback_query", "edited_message"):
+        if kind in update:
+            return update[kind].get("from", {}).get("id")
+    return None
+
+
+def callback_kind(data: str) -> str:
+    try:
+        return RequestCallback.unpack(data).action.name.lower()
+    except (TypeError, ValueError):
+        return data.split(":")[0]
+
+
+def burst_profile(records, window: float = 1.0) -> dict:
+    """Пікова кількість оновлень за вікно і найгарячіші види оновлень."""
+    peak = 0
+    start = 0
+    for end, record in enumerate(records):
+        while record["t"] - records[start]["t"] > window:
+            start += 1
+        peak = max(peak, end - start + 1)
+
+    kinds = Counter()
+    for record in records:
+        update = record["update"]
+        if "callback_query" in update:
+            kinds["callback:" + callback_kind(update["callback_query"].get("data", ""))] += 1
+        elif "message" in update:
+            kinds["message"] += 1
+        else:
+            kinds["other"] += 1
+    return {"peak_per_window": peak, "window_s": window, "kinds": dict(kinds.most_common())}
+
+
+class RequestIds:
+    """Зіставляє номери запитів із запису з номерами, які видала БД відтворення.
+
+    Запит із запису - це k-й запит свого студента (за нотатками recorder.note_request);
+    при відтворенні йому відповідає k-й запит, створений для того самого студента.
+    """
+
+    CALLBACKS = (RequestCallback, SnippetCallback, HistoryCallback)
+
+    def __init__(self, notes, timeout: float = 10.0):
+        self.timeout = timeout
+        self.stats = Counter()
+        # номер із запису -> (студент, порядковий номер його запиту)
+        self._recorded = {}
+        counts = Counter()
+        for note in notes:
+            self._recorded[note["request_id"]] = (note["student"], counts[note["student"]])
+            counts[note["student"]] += 1
+        self._created = Counter()
+        self._replayed = {}
+
+    def _future(self, key) -> asyncio.Future:
+        if key not in self._replayed:
+            self._replayed[key] = asyncio.get_running_loop().create_future()
+        return self._replayed[key]
+
+    def created(self, student_id: int, request_id: int):
+        """Викликається, коли при відтворенні студентові видано номер запиту.
+
+        Номер віддається після обробки всього оновлення студента: доти запиту ще
+        немає в пам'яті main, і натискання куратора отримало б "Запит не знайдено".
+        """
+        future = self._future((student_id, self._created[student_id]))
+        self._created[student_id] += 1
+        asyncio.current_task().add_done_callback(
+            lambda _: future.done() or future.set_result(request_id))
+
+    async def resolve(self, request_id: int):
+        """Номер у БД відтворення; None, якщо запит створено до початку запису або не створено."""
+        key = self._recorded.get(request_id)
+        if key is None:
+            return None
+        # Запит студента обробляється в його черзі, а натискання куратора - в іншій
+        try:
+            return await asyncio.wait_for(asyncio.shield(self._future(key)), self.timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def rewrite(self, data: str) -> str:
+        for factory in self.CALLBACKS:
+            try:
+                callback = factory.unpack(data)
+            except (TypeError, ValueError):
+                continue
+            request_id = await self.resolve(callback.request_id)
+            if request_id is None:
+                self.stats["unmapped"] += 1
+                return data
+            self.stats["mapped"] += 1
+            return callback.model_copy(update={"request_id": request_id}).pack()
+        return data
+
+
+async def feed_after(previous, dp, bot, update: dict, request_ids: RequestIds):
+    if previous is not None:
+        await asyncio.gather(previous, return_exceptions=True)
+    callback = update.get("callback_query")
+    if callback and "data" in callback:
+        callback = {**callback, "data": await request_ids.rewrite(callback["data"])}
+        update = {**update, "callback_query": callback}
+    await dp.feed_update(bot, Update.model_validate(update, context={"bot": bot}))
+
+
+async def replay(args) -> dict:
+    header, records, notes = read_recording(args.recording)
+    speed = None if args.speed == "max" else float(args.speed)
+
+    api = FakeBotAPI(latency=args.latency)
+    await api.start()
+    workdir = tempfile.mkdtemp(prefix="replay-")
+    prepare_env(api.url, f"sqlite+aiosqlite:///{workdir}/replay.db", header["teachers"],
+                curator_chat_id=header["curator_chat_id"])
+
+    import main as app
+    from db import close_db
+
+    await app.warm_up()
+
+    request_ids = RequestIds(notes)
+    create_request = app.create_request
+
+    async def create_and_note(**fields):
+        request_id = await create_request(**fields)
+        if request_id is not None:
+            request_ids.created(fields["student_id"], int(request_id))
+        return request_id
+
+    app.create_request = create_and_note
+
+    update_timer = UpdateTimer()
+    handler_timer = HandlerTimer()
+    if not args.flood_control:
+        app.dp.update.outer_middleware.unregister(app.flood_control)
+    app.dp.update.outer_middleware(update_timer)
+    app.dp.message.middleware(handler_timer)
+    app.dp.callback_query.middleware(handler_timer)
+
+    tasks = []
+    last_task = {}
+    lag = []
+    started = time.perf_counter()
+    try:
+        output = open(os.devnull, "w") if args.quiet else sys.stdout
+        with contextlib.redirect_stdout(output):
+            for record in records:
+                if speed:
+                    due = record["t"] / speed
+                    delay = due - (time.perf_counter() - started)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    lag.append(max(0.0, -delay))
+                # Як і при polling, кожне оновлення обробляється окремою задачею, але події
+                # одного користувача йдуть по черзі: при прискоренні відповідь куратора
+                # інакше обганяє натискання "Відповісти"
+                key = sender_key(record["update"])
+                task = asyncio.create_task(feed_after(last_task.get(key), app.dp, app.get_bot(),
+                                                     record["update"], request_ids))
+                if key is not None:
+                    last_task[key] = task
+                tasks.append(task)
+            await asyncio.gather(*tasks, return_exceptions=True)
+        elapsed = time.perf_counter() - started
+    finally:
+        await app.get_bot().session.close()
+        await close_db()
+        await api.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = update_timer.latencies
+    return {
+        "recording": args.recording,
+        "speed": args.speed,
+        "updates": len(records),
+        "recorded_span_s": records[-1]["t"] - records[0]["t"] if records else 0.0,
+        "elapsed_s": elapsed,
+        "throughput_ups": len(records) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "schedule_lag_p99_ms": percentile(lag, 99) * 1000,
+        "api_calls": dict(api.calls),
+        "handler_errors": dict(update_timer.errors),
+        "flood_control": dict(app.flood_control.stats) if args.flood_control else None,
+        "request_ids": dict(request_ids.stats),
+        "bursts": burst_profile(records),
+        "handlers": handler_timer.report(),
+    }
+
+
+def print_report(result: dict):
+    print(f"Запис: {result['recording']}, швидкість: {result['speed']}")
+    print(f"Оновлень: {result['updates']} (записано за {result['recorded_span_s']:.1f} с), "
+          f"відтворено за {result['elapsed_s']:.2f} с -> {result['throughput_ups']:.1f} оновл./с")
+    print(f"Латентність оновлення: p50 {result['p50_ms']:.2f} мс, p99 {result['p99_ms']:.2f} мс")
+    if result["speed"] != "max":
+        print(f"Відставання від розкладу p99: {result['schedule_lag_p99_ms']:.2f} мс")
+    bursts = result["bursts"]
+    print(f"Пік: {bursts['peak_per_window']} оновлень за {bursts['window_s']:.0f} с; за видами: {bursts['kinds']}")
+    if result["flood_control"] is not None:
+        print(f"Захист від флуду: {result['flood_control'] or 'нічого не відкинуто'}")
+    if result["request_ids"].get("unmapped"):
+        print(f"Номери запитів у callback-даних: {result['request_ids']} "
+              "(незіставлені подано як є)")
+    if result["handler_errors"]:
+        print(f"Помилки обробників: {result['handler_errors']}")
+    print("Обробники (за сумарним часом):")
+    for name, stats in result["handlers"].items():
+        print(f"  {name:<34} n={stats['count']:<7} p50 {stats['p50_ms']:8.2f} мс  "
+              f"p99 {stats['p99_ms']:8.2f} мс  всього {stats['total_s']:.2f} с")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Відтворення записаних оновлень для профілювання")
+    parser.add_argument("recording", help="файл, записаний через RECORD_UPDATES")
+    parser.add_argument("--speed", default="1", choices=("1", "10", "max"))
+    parser.add_argument("--latency", type=float, default=0.0, help="затримка симулятора Bot API, с")
+    parser.add_argument("--flood-control", action="store_true",
+                        help="не вимикати захист від флуду (при прискоренні він відкидає оновлення)")
+    parser.add_argument("--json", help="зберегти звіт у файл")
+    parser.add_argument("--verbose", dest="quiet", action="store_false", help="не приховувати вивід бота")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    result = asyncio.run(replay(args))
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
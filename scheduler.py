@@ -0,0 +1,128 @@
+"""Планувальник періодичних задач усередині процесу бота.
+
+Розклад задається рядком "daily 09:00" або "weekly mon 09:00" (київський час).
+Час останнього запуску кожної задачі зберігається в таблиці scheduled_tasks і
+переноситься атомарно перед запуском, тож після перезапуску або при двох
+процесах одночасно (під час деплою) задача виконується рівно один раз.
+Пропущені за час простою запуски не накопичуються: виконується лише останній.
+"""
+import asyncio
+import logging
+from contextlib import suppress
+from datetime import date, datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from db import claim_task_run, get_task_last_run
+
+logger = logging.getLogger("bot.scheduler")
+
+KYIV = ZoneInfo("Europe/Kiev")
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+
+class Schedule:
+    def __init__(self, spec: str):
+        parts = spec.lower().split()
+        if len(parts) == 2 and parts[0] == "daily":
+            self.weekday = None
+        elif len(parts) == 3 and parts[0] == "weekly" and parts[1] in WEEKDAYS:
+            self.weekday = WEEKDAYS.index(parts[1])
+        else:
+            raise ValueError(f"Невідомий розклад: {spec!r} (очікується 'daily ГГ:ХХ' або 'weekly mon ГГ:ХХ')")
+        hour, minute = parts[-1].split(":")
+        self.hour, self.minute = int(hour), int(minute)
+        self.spec = spec
+
+    def _at(self, day: date) -> datetime:
+        """Запланований момент у київський день day (UTC без часового поясу)."""
+        local = datetime.combine(day, time(self.hour, self.minute), tzinfo=KYIV)
+        return local.astimezone(timezone.utc).replace(tzinfo=None)
+
+    def _matches(self, day: date) -> bool:
+        return self.weekday is None or day.weekday() == self.weekday
+
+    def latest_due(self, now: datetime) -> datetime:
+        """Останній запланований момент не пізніше now (обидва - UTC без часового поясу)."""
+        # Дні перебираються за київським календарем: зміщення UTC у день переходу
+        # на літній/зимовий час інше, тож додавати до UTC рівно добу чи тиждень не можна
+        day = now.replace(tzinfo=timezone.utc).astimezone(KYIV).date()
+        while not (self._matches(day) and self._at(day) <= now):
+            day -= timedelta(days=1)
+        return self._at(day)
+
+    def next_due(self, after: datetime) -> datetime:
+        """Перший запланований момент після after."""
+        day = after.replace(tzinfo=timezone.utc).astimezone(KYIV).date()
+        while not (self._matches(day) and self._at(day) > after):
+            day += timedelta(days=1)
+        return self._at(day)
+
+
+class Job:
+    def __init__(self, name: str, schedule: Schedule, func):
+        self.name = name
+        self.schedule = schedule
+        # func(since, until) отримує період від попереднього запуску до поточного
+        self.func = func
+        self.next_run = None
+
+
+class Scheduler:
+    def __init__(self, tick: float = 30.0):
+        self.tick = tick
+        self.jobs = []
+        self._task = None
+        self._busy = False
+        self._stopping = asyncio.Event()
+
+    def add(self, name: str, spec: str, func):
+        self.jobs.append(Job(name, Schedule(spec), func))
+
+    async def _check(self, job: Job, now: datetime):
+        if job.next_run is not None and now < job.next_run:
+            return
+        # Першого разу задача не запускається заднім числом, а чекає найближчого моменту
+        last_run = await get_task_last_run(job.name, job.schedule.latest_due(now))
+        if last_run is None:
+            return
+        due = job.schedule.latest_due(now)
+        if due <= last_run:
+            job.next_run = job.schedule.next_due(last_run)
+            return
+        job.next_run = job.schedule.next_due(due)
+        if not await claim_task_run(job.name, last_run, due):
+            logger.info("Запуск уже виконано іншим процесом", extra={"task": job.name})
+            return
+        logger.info("Запуск задачі", extra={"task": job.name, "since": last_run.isoformat()})
+        self._busy = True
+        try:
+            await job.func(last_run, due)
+        except Exception:
+            logger.exception("Помилка задачі планувальника", extra={"task": job.name})
+        finally:
+            self._busy = False
+
+    async def run(self):
+        while not self._stopping.is_set():
+            now = datetime.utcnow()
+            for job in self.jobs:
+                if self._stopping.is_set():
+                    return
+                await self._check(job, now)
+            # Чекаємо на подію, а не sleep: stop() не мусить дочекатися кінця такту
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._stopping.wait(), self.tick)
+
+    def start(self) -> asyncio.Task:
+        self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self, timeout: float = 0.0):
+        """Зупиняє планувальник; задачу, що саме виконується, спершу чекає до timeout секунд:
+        запуск уже зафіксовано в БД, тож обірвана задача не повториться після перезапуску."""
+        self._stopping.set()
+        if self._task is None:
+            return
+        if self._busy and timeout:
+            await asyncio.wait([self._task], timeout=timeout)
+        self._task.cancel()
@@ -0,0 +1,118 @@
+"""Розподіл тем запитів між кількома форумами кураторів.
+
+CURATOR_CHAT_IDS задає форуми через кому: "тег=chat_id" або просто chat_id,
+наприклад "math=-1001,physics=-1002,-1003". Запит з хештегом предмета (#math)
+іде у форум цього тегу, решта - у форуми без тегу за rendezvous-хешем student_id:
+той самий студент завжди потрапляє в той самий форум, а додавання нового форуму
+переносить лише ~1/N студентів. Кожен форум має власне відро токенів.
+"""
+import contextvars
+import hashlib
+import logging
+import re
+from collections import Counter
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from ratelimit import TokenBucket
+
+logger = logging.getLogger("bot.shards")
+
+TAG_PATTERN = re.compile(r"#(\w+)")
+MAX_ATTEMPTS = 3
+
+# True під час обробки дії куратора: її виклики йдуть пріоритетною чергою відра форуму,
+# щоб хвиля нових тем не затримувала взяття й завершення запитів
+priority_lane = contextvars.ContextVar("forum_priority_lane", default=False)
+
+
+class ForumShard:
+    def __init__(self, chat_id: int, tags=(), bucket: TokenBucket = None):
+        self.chat_id = chat_id
+        self.tags = tuple(tags)
+        self.bucket = bucket
+
+
+def parse_shards(spec: str, default_chat_id: int = None):
+    """Розбирає CURATOR_CHAT_IDS у список (chat_id, теги); порожній рядок - лише default_chat_id."""
+    tags = {}
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        tag, _, chat_id = item.rpartition("=")
+        chat_tags = tags.setdefault(int(chat_id), [])
+        if tag:
+            chat_tags.append(tag.strip().lower().lstrip("#"))
+    if not tags and default_chat_id:
+        tags[default_chat_id] = []
+    return list(tags.items())
+
+
+def _score(chat_id: int, student_id: int) -> int:
+    digest = hashlib.blake2b(f"{chat_id}:{student_id}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class ShardRouter:
+    """Обирає форум для нового запиту. rate - повідомлень на секунду в один форум (0 - без обмеження)."""
+
+    def __init__(self, shards, rate: float = 0, burst: int = 20):
+        self.shards = [
+            ForumShard(chat_id, tags, TokenBucket(rate, burst) if rate else None)
+            for chat_id, tags in shards
+        ]
+        self.stats = Counter()
+        self._by_chat = {shard.chat_id: shard for shard in self.shards}
+        self._by_tag = {tag: shard for shard in self.shards for tag in shard.tags}
+        # Запити без тегу йдуть у загальні форуми, а якщо всі форуми предметні - у будь-який
+        self._general = [shard for shard in self.shards if not shard.tags] or self.shards
+
+    @property
+    def default_chat_id(self):
+        return self._general[0].chat_id if self.shards else None
+
+    @property
+    def chat_ids(self):
+        return list(self._by_chat)
+
+    def route(self, student_id: int, text: str = "") -> int:
+        shard = None
+        for tag in TAG_PATTERN.findall((text or "").lower()):
+            shard = self._by_tag.get(tag)
+            if shard is not None:
+                break
+        if shard is None:
+            shard = max(self._general, key=lambda candidate: _score(candidate.chat_id, student_id))
+        self.stats[shard.chat_id] += 1
+        return shard.chat_id
+
+    def bucket(self, chat_id):
+        shard = self._by_chat.get(chat_id)
+        return shard.bucket if shard is not None else None
+
+
+class ShardRateLimiter(BaseRequestMiddleware):
+    """Middleware сесії бота: виклики в чат форуму проходять через відро цього форуму.
+
+    Після 429 відро форуму ставиться на паузу retry_after, і виклик повторюється.
+    Виклики з увімкненим priority_lane отримують токени раніше за решту.
+    """
+
+    def __init__(self, router: ShardRouter):
+        self.router = router
+
+    async def __call__(self, make_request, bot, method):
+        bucket = self.router.bucket(getattr(method, "chat_id", None))
+        if bucket is None:
+            return await make_request(bot, method)
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            await bucket.acquire(priority=priority_lane.get())
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == MAX_ATTEMPTS:
+                    raise
+                logger.warning("Форум отримав 429, пауза %s с", e.retry_after, extra={"chat_id": method.chat_id})
+                bucket.pause(e.retry_after)
@@ -0,0 +1,70 @@
+"""Бібліотека шаблонних відповідей і підбір підказок до нового запиту.
+
+Індекс будується заново при старті й після кожної зміни бібліотеки: для кожного
+шаблону (заголовок + текст) рахується TF-IDF вектор за основами слів - першими
+STEM_LENGTH літерами, щоб "лабораторна" й "лабораторну" збігалися - і нормується
+до одиниці. Пошук проходить лише по списках шаблонів для слів запиту, тож на
+тисячах шаблонів займає частки мілісекунди.
+"""
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+
+WORD_PATTERN = re.compile(r"\w+")
+STEM_LENGTH = 6
+MIN_WORD_LENGTH = 3
+
+
+def terms(text: str):
+    """Основи слів тексту: нижній регістр, не коротші за MIN_WORD_LENGTH, обрізані до STEM_LENGTH."""
+    return [word[:STEM_LENGTH] for word in WORD_PATTERN.findall((text or "").lower())
+            if len(word) >= MIN_WORD_LENGTH]
+
+
+class SnippetIndex:
+    def __init__(self, snippets=()):
+        self.snippets = {}
+        self._idf = {}
+        self._postings = {}
+        self.build(snippets)
+
+    def build(self, snippets):
+        """snippets - об'єкти з полями id, title, text (наприклад, рядки таблиці snippets)."""
+        documents = {snippet.id: Counter(terms(f"{snippet.title} {snippet.text}")) for snippet in snippets}
+        document_frequency = Counter(term for counts in documents.values() for term in counts)
+        total = len(documents)
+        idf = {term: math.log((1 + total) / (1 + count)) + 1 for term, count in document_frequency.items()}
+
+        postings = defaultdict(list)
+        for snippet_id, counts in documents.items():
+            weights = {term: (1 + math.log(count)) * idf[term] for term, count in counts.items()}
+            norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+            for term, weight in weights.items():
+                postings[term].append((snippet_id, weight / norm))
+
+        # Нові структури підміняються цілком, тож пошук ніколи не бачить напівзібраний індекс
+        self.snippets = {snippet.id: (snippet.title, snippet.text) for snippet in snippets}
+        self._idf = idf
+        self._postings = dict(postings)
+
+    def search(self, text: str, limit: int = 3, min_score: float = 0.15):
+        """Найближчі до тексту шаблони: список (snippet_id, схожість від 0 до 1), від найкращого."""
+        scores = defaultdict(float)
+        query_norm = 0.0
+        for term, count in Counter(terms(text)).items():
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            weight = (1 + math.log(count)) * self._idf[term]
+            query_norm += weight * weight
+            for snippet_id, snippet_weight in postings:
+                scores[snippet_id] += weight * snippet_weight
+        if not scores:
+            return []
+        query_norm = math.sqrt(query_norm)
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [(snippet_id, score / query_norm) for snippet_id, score in best if score / query_norm >= min_score]
+
+    def __len__(self):
+        return len(self.snippets)
@@ -0,0 +1,68 @@
+"""Швидкий холодний старт.
+
+Опитування Telegram починається, щойно перевірено схему БД (і попередній процес
+віддав опитування, див. lifecycle.py), а кеші (ростер кураторів, відкриті запити)
+завантажуються паралельно з першим getUpdates.
+Оновлення, що прийшли до завершення прогріву, чекають на нього в Startup.
+Час від запуску процесу до першого оновлення й етапи прогріву пишуться в лог.
+"""
+import asyncio
+import logging
+import time
+
+from aiogram import BaseMiddleware
+
+logger = logging.getLogger("bot.startup")
+
+# main імпортує цей модуль першим, тож це найближча до запуску процесу точка
+PROCESS_STARTED = time.perf_counter()
+
+
+class Startup(BaseMiddleware):
+    def __init__(self):
+        self.metrics = {}
+        self.ready = asyncio.Event()
+        # Схема БД перевірена (таблиці є): на це чекає Lifecycle.take_over
+        self.schema_ready = asyncio.Event()
+        self.task = None
+
+    def mark(self, stage: str):
+        """Запам'ятовує, скільки секунд минуло від запуску процесу до етапу."""
+        self.metrics[stage] = round(time.perf_counter() - PROCESS_STARTED, 3)
+
+    async def _load(self, loader):
+        started = time.perf_counter()
+        try:
+            await loader()
+        except Exception:
+            logger.exception("Помилка прогріву", extra={"loader": loader.__name__})
+        self.metrics[f"{loader.__name__}_seconds"] = round(time.perf_counter() - started, 3)
+
+    async def warm_up(self, schema, *loaders):
+        """Спершу schema(), потім усі loaders паралельно. ready встановлюється за будь-якого результату."""
+        try:
+            await self._load(schema)
+            self.mark("schema_ready")
+            self.schema_ready.set()
+            await asyncio.gather(*(self._load(loader) for loader in loaders))
+        finally:
+            self.mark("warm")
+            self.schema_ready.set()
+            self.ready.set()
+            logger.info("Прогрів завершено", extra=self.metrics)
+
+    def start(self, schema, *loaders) -> asyncio.Task:
+        self.task = asyncio.create_task(self.warm_up(schema, *loaders))
+        return self.task
+
+    async def on_polling_started(self):
+        self.mark("polling_started")
+
+    async def __call__(self, handler, event, data):
+        if "first_update" not in self.metrics:
+            self.mark("first_update")
+            logger.info("Отримано перше оновлення",
+                        extra={"time_to_first_update": self.metrics["first_update"]})
+        if not self.ready.is_set():
+            await self.ready.wait()
+        return await handler(event, data)
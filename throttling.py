@@ -0,0 +1,92 @@
+"""Захист від флуду на вході диспетчера.
+
+Кожен користувач має власне відро токенів: надлишкові оновлення відкидаються.
+Загальна кількість оновлень в обробці обмежена: при перевантаженні нове оновлення
+чекає вільного місця до defer_timeout, потім відкидається. Користувач отримує
+повідомлення "зачекайте" не частіше одного разу за notice_window.
+Куратори й адміністратор проходять без обмежень, щоб їхні дії не голодували.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter, OrderedDict
+
+from aiogram import BaseMiddleware
+
+from ratelimit import TokenBucket
+
+logger = logging.getLogger("bot.throttling")
+
+PLEASE_WAIT = "⏳ Забагато повідомлень. Зачекайте трохи й надішліть ще раз."
+
+
+class FloodControlMiddleware(BaseMiddleware):
+    def __init__(self, rate: float, burst: int, max_in_flight: int, defer_timeout: float,
+                 notice_window: float, is_priority, max_users: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.defer_timeout = defer_timeout
+        self.notice_window = notice_window
+        self.is_priority = is_priority
+        self.max_users = max_users
+        self.stats = Counter()
+        self._buckets = OrderedDict()
+        self._notified = {}
+        self._slots = asyncio.Semaphore(max_in_flight)
+
+    def _bucket(self, user_id: int) -> TokenBucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user_id)
+        return bucket
+
+    async def _notify(self, event, user_id: int):
+        try:
+            await self._send_notice(event, user_id)
+        except Exception as e:
+            logger.warning("Не вдалося надіслати попередження про флуд: %s", e)
+
+    async def _send_notice(self, event, user_id: int):
+        if event.callback_query:
+            await event.callback_query.answer(PLEASE_WAIT)
+            return
+        now = time.monotonic()
+        if now - self._notified.get(user_id, -self.notice_window) < self.notice_window:
+            return
+        self._notified[user_id] = now
+        if len(self._notified) > self.max_users:
+            self._notified = {uid: t for uid, t in self._notified.items() if now - t < self.notice_window}
+        if event.message:
+            await event.message.answer(PLEASE_WAIT)
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None or self.is_priority(user.id):
+            return await handler(event, data)
+
+        if not self._bucket(user.id).try_acquire():
+            self.stats["dropped_user"] += 1
+            logger.info("Оновлення відкинуто: ліміт користувача", extra={"user_id": user.id, "hot": True})
+            await self._notify(event, user.id)
+            return None
+
+        if self._slots.locked():
+            self.stats["deferred"] += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.defer_timeout)
+            except asyncio.TimeoutError:
+                self.stats["dropped_overload"] += 1
+                logger.warning("Оновлення відкинуто: перевантаження", extra={"user_id": user.id})
+                await self._notify(event, user.id)
+                return None
+        else:
+            await self._slots.acquire()
+
+        try:
+            return await handler(event, data)
+        finally:
+            self._slots.release()